@@ -0,0 +1,483 @@
+# python
+import argparse
+import fnmatch
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import queue
+import subprocess
+import threading
+import wave
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+
+from trash import move_trashed_files, trash_file
+
+# seconds a single ffmpeg job may run before it is killed
+JOB_TIMEOUT = 3600
+
+# manifest of finished conversions, kept in the output directory
+MANIFEST_NAME = ".conversion_manifest.jsonl"
+
+# serialises appends to the manifest from the worker threads
+manifest_lock = threading.Lock()
+
+# what to do with an original once it has been converted
+RETENTION_POLICIES = ["trash", "delete", "keep"]
+
+# cross-device moves to the Trash that may wait for the mover thread
+TRASH_QUEUE_SIZE = 64
+
+
+def default_workers():
+    """
+    Return the number of CPUs this process may run on.
+    Each job is one ffmpeg process, so run one job per CPU.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # not available on macOS and Windows
+        return os.cpu_count() or 1
+
+
+def get_file_size(path):
+    """
+    Return the size of a file in bytes, or 0 if it is inaccessible.
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def matches_any(name, relative_path, patterns):
+    """
+    Return True if a file name or its relative path matches any of the
+    lowercase glob patterns, ignoring case.
+    """
+    name = name.lower()
+    relative_path = relative_path.lower()
+    return any(
+        fnmatch.fnmatchcase(name, pattern)
+        or fnmatch.fnmatchcase(relative_path, pattern)
+        for pattern in patterns
+    )
+
+
+def find_files(directory, include, exclude=()):
+    """
+    Yield the paths of files under directory that match any include glob and
+    no exclude glob, as soon as they are found, without needing find.
+    Globs are matched ignoring case against both the name and the path
+    relative to directory, and exclude globs also prune whole directories.
+    Symlinked directories are followed, but every directory is entered only
+    once, so symlink loops are skipped.
+    """
+    include = [pattern.lower() for pattern in include]
+    exclude = [pattern.lower() for pattern in exclude]
+    try:
+        stat = os.stat(directory)
+    except OSError as e:
+        print(f"Error finding files: {e}")
+        return
+    # directories entered so far, as (device, inode)
+    visited = {(stat.st_dev, stat.st_ino)}
+    stack = [(directory, "")]
+
+    while stack:
+        path, relative_dir = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    relative_path = (
+                        f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                    )
+                    if matches_any(entry.name, relative_path, exclude):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            stat = entry.stat()
+                            if (stat.st_dev, stat.st_ino) not in visited:
+                                visited.add((stat.st_dev, stat.st_ino))
+                                stack.append((entry.path, relative_path))
+                        elif entry.is_file() and matches_any(
+                            entry.name, relative_path, include
+                        ):
+                            yield entry.path
+                    except OSError:
+                        # broken symlinks and vanished entries
+                        continue
+        except OSError as e:
+            print(f"Error finding files: {e}")
+
+
+def run_ffmpeg(arguments, output_filename, timeout=None):
+    """
+    Run ffmpeg with the given arguments and return True if it succeeded.
+    ffmpeg is killed after timeout seconds. On failure any partial output
+    file is removed, so it is not mistaken for a finished conversion.
+    """
+    try:
+        result = subprocess.run(
+            ["ffmpeg", *arguments], stdin=subprocess.DEVNULL, timeout=timeout
+        )
+        succeeded = result.returncode == 0
+    except subprocess.TimeoutExpired:
+        print(f"\tTimed out after {timeout} seconds")
+        succeeded = False
+    except OSError as e:
+        print(f"\tCould not run ffmpeg: {e}")
+        succeeded = False
+
+    if not succeeded and os.path.exists(output_filename):
+        os.remove(output_filename)
+    return succeeded
+
+
+def partial_path(output_filename):
+    """
+    Return the hidden file an output is written to until it is complete.
+    """
+    output_dir, output_name = os.path.split(output_filename)
+    return os.path.join(output_dir, f".{output_name}.part")
+
+
+def transcode(original_filename, output_filename, arguments, timeout=None):
+    """
+    Convert original_filename to output_filename with ffmpeg, passing the
+    given arguments before the output. ffmpeg writes to a hidden partial
+    file next to the output that is only renamed into place once it is
+    complete, so a crash never leaves a truncated output behind.
+    Returns True if the conversion succeeded.
+    """
+    partial_filename = partial_path(output_filename)
+    # the partial name hides the extension, so name the format explicitly
+    output_format = os.path.splitext(output_filename)[1].lstrip(".")
+    succeeded = run_ffmpeg(
+        [
+            "-i",
+            original_filename,
+            *arguments,
+            "-f",
+            output_format,
+            "-y",
+            partial_filename,
+        ],
+        partial_filename,
+        timeout,
+    )
+    if succeeded:
+        os.replace(partial_filename, output_filename)
+    return succeeded
+
+
+def output_path(original_filename, output_dir, extension, input_dir=None):
+    """
+    Return the output filename for original_filename with the new extension.
+    If input_dir is given, the file's location below input_dir is kept
+    below output_dir, so files with the same name in different folders do
+    not collide. Missing output folders are created.
+    """
+    relative_path = os.path.basename(original_filename)
+    if input_dir is not None:
+        relative_path = os.path.relpath(original_filename, input_dir)
+        if relative_path.startswith(os.pardir):
+            relative_path = os.path.basename(original_filename)
+    output_filename = os.path.join(
+        output_dir, os.path.splitext(relative_path)[0] + extension
+    )
+    os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+    return output_filename
+
+
+def hash_file(filename):
+    """
+    Return the SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(output_dir):
+    """
+    Load the manifest of finished conversions in output_dir as a dictionary
+    mapping each absolute input path to its latest record.
+    """
+    manifest = {}
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash
+                    continue
+                manifest[record["input"]] = record
+    except FileNotFoundError:
+        pass
+    return manifest
+
+
+def is_converted(manifest, original_filename, output_filename):
+    """
+    Return True if the manifest records original_filename as converted to
+    output_filename and neither has changed since. Unchanged size and mtime
+    are trusted as is; if only the mtime changed, the content hash decides.
+    """
+    record = manifest.get(os.path.abspath(original_filename))
+    if record is None or record["output"] != os.path.abspath(output_filename):
+        return False
+    try:
+        stat = os.stat(original_filename)
+    except OSError:
+        return False
+    if stat.st_size != record["size"] or not os.path.exists(output_filename):
+        return False
+    if stat.st_mtime_ns == record["mtime_ns"]:
+        return True
+    return hash_file(original_filename) == record["sha256"]
+
+
+def record_conversion(output_dir, manifest, original_filename, output_filename):
+    """
+    Append a record of a finished conversion to the manifest in output_dir.
+    Must be called before the original is moved away.
+    """
+    stat = os.stat(original_filename)
+    record = {
+        "input": os.path.abspath(original_filename),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": hash_file(original_filename),
+        "output": os.path.abspath(output_filename),
+    }
+    with manifest_lock:
+        with open(os.path.join(output_dir, MANIFEST_NAME), "a") as file:
+            file.write(json.dumps(record) + "\n")
+        manifest[record["input"]] = record
+
+
+def audio_length(filename):
+    """
+    Return the number of sample frames and the sample rate of a .wav or
+    .flac file, or None if they cannot be read.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    try:
+        if extension == ".wav":
+            with wave.open(filename, "rb") as wav:
+                return wav.getnframes(), wav.getframerate()
+        if extension == ".flac":
+            # "fLaC", then the header of the STREAMINFO block and its body
+            with open(filename, "rb") as file:
+                header = file.read(42)
+            if len(header) < 42 or header[:4] != b"fLaC" or header[4] & 0x7F:
+                return None
+            # 20 bits of sample rate, 8 of channels and bit depth, 36 of frames
+            info = int.from_bytes(header[18:26], "big")
+            return info & (2**36 - 1), info >> 44
+    except (OSError, EOFError, wave.Error):
+        pass
+    return None
+
+
+def verify_output(original_filename, output_filename):
+    """
+    Return True if the output has the same duration as the original: the
+    same number of sample frames, or within 10 ms if it was resampled.
+    """
+    original = audio_length(original_filename)
+    output = audio_length(output_filename)
+    if not original or not output or not all(original + output):
+        return False
+    (original_frames, original_rate), (output_frames, output_rate) = original, output
+    if original_rate == output_rate:
+        return original_frames == output_frames
+    expected_frames = original_frames * output_rate / original_rate
+    return abs(output_frames - expected_frames) <= output_rate / 100
+
+
+def retire_original(
+    original_filename, output_filename, policy="trash", trash_queue=None
+):
+    """
+    Deal with an original once it has been converted, according to policy:
+    "trash" moves it to the Trash, "delete" deletes it if verify_output
+    confirms the output is complete, and "keep" leaves it where it is.
+    """
+    try:
+        if policy == "trash":
+            trash_file(original_filename, trash_queue)
+        elif policy == "delete":
+            if verify_output(original_filename, output_filename):
+                os.remove(original_filename)
+                print(f"\tDeleted {original_filename}")
+            else:
+                print(f"\tKept {original_filename}: could not verify the output")
+    except OSError as e:
+        print(f"\tError removing {original_filename}: {e}")
+
+
+def run_conversions(filenames, convert, max_workers=None, lookahead=None):
+    """
+    Run convert(filename) for every filename on a pool of max_workers threads.
+    Filenames are pulled from the iterable lazily and kept in a window of at
+    most lookahead pending files, so memory stays bounded. Whenever a worker
+    is free the largest pending file starts next, so a long file does not end
+    up running alone at the end of the batch.
+    convert should return True when it converted a file, False when it
+    failed and None when it skipped it. Returns a dictionary of counts.
+    """
+    max_workers = max_workers or default_workers()
+    lookahead = lookahead or max_workers * 4
+    counts = {"converted": 0, "failed": 0, "skipped": 0}
+    files = iter(filenames)
+    # pending files as a max-heap on size, the counter keeps ties in order
+    pending = []
+    order = itertools.count()
+    in_flight = {}
+    exhausted = False
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            # keep discovering files until the window is full
+            while not exhausted and len(pending) < lookahead:
+                filename = next(files, None)
+                if filename is None:
+                    exhausted = True
+                    break
+                entry = (-get_file_size(filename), next(order), filename)
+                heapq.heappush(pending, entry)
+                # start work as soon as there is a free worker
+                if len(in_flight) < max_workers:
+                    break
+
+            # hand the largest pending files to free workers
+            while pending and len(in_flight) < max_workers:
+                _, _, filename = heapq.heappop(pending)
+                in_flight[executor.submit(convert, filename)] = filename
+
+            if not in_flight:
+                if exhausted and not pending:
+                    break
+                continue
+
+            # with room left in the window, only check on the workers
+            timeout = 0 if not exhausted and len(pending) < lookahead else None
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"\tError converting {filename}: {e}")
+                    result = False
+                if result is None:
+                    counts["skipped"] += 1
+                elif result:
+                    counts["converted"] += 1
+                else:
+                    counts["failed"] += 1
+
+    return counts
+
+
+def convert_directory(
+    input_dir,
+    output_dir,
+    find,
+    convert,
+    max_workers=None,
+    timeout=JOB_TIMEOUT,
+    policy="trash",
+):
+    """
+    Convert every file find(input_dir) yields into output_dir by calling
+    convert(filename, output_dir, timeout=..., input_dir=..., manifest=...,
+    retire=...) on a worker pool. The manifest of earlier runs lets convert
+    skip finished files, and retire(original, output) applies the retention
+    policy to each converted original.
+    """
+    # validate the input directory
+    if not os.path.isdir(input_dir):
+        print(f"Error: The input directory '{input_dir}' does not exist.")
+        return
+
+    # create the output directory if it does not exist
+    os.makedirs(output_dir, exist_ok=True)
+
+    # a single thread copies originals to a Trash on another filesystem
+    trash_queue = queue.Queue(maxsize=TRASH_QUEUE_SIZE)
+    mover = threading.Thread(target=move_trashed_files, args=(trash_queue,))
+    mover.start()
+    try:
+        counts = run_conversions(
+            find(input_dir),
+            partial(
+                convert,
+                output_dir=output_dir,
+                timeout=timeout,
+                input_dir=input_dir,
+                manifest=load_manifest(output_dir),
+                retire=partial(retire_original, policy=policy, trash_queue=trash_queue),
+            ),
+            max_workers=max_workers,
+        )
+    finally:
+        # let the mover finish the queued moves
+        trash_queue.put(None)
+        mover.join()
+    print(
+        f"Converted {counts['converted']}, skipped {counts['skipped']}, "
+        f"failed {counts['failed']}"
+    )
+
+
+def build_parser(source_format, target_format):
+    """
+    Build the command line parser shared by the converters. Directories that
+    are not given on the command line are prompted for.
+    """
+    parser = argparse.ArgumentParser(
+        description=f"Convert .{source_format} files to .{target_format}."
+    )
+    parser.add_argument(
+        "input_dir", nargs="?", help=f"directory containing .{source_format} files"
+    )
+    parser.add_argument(
+        "output_dir", nargs="?", help=f"output directory for .{target_format} files"
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        help=f"glob of files to convert (default: *.{source_format}), repeatable",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        help="glob of files or directories to skip, repeatable",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="parallel conversions (default: one per CPU)"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=JOB_TIMEOUT,
+        help=f"seconds before a conversion is killed (default: {JOB_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--originals",
+        choices=RETENTION_POLICIES,
+        default="trash",
+        help="move converted originals to the Trash (default), delete them "
+        "once the output's length is verified, or keep them",
+    )
+    return parser
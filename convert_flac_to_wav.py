@@ -1,90 +1,99 @@
 # python
 import os
-import datetime as dt
-import shutil
-import subprocess
-from concurrent.futures import ThreadPoolExecutor
-
-# define the Trash directory for deleted files
-TRASH_DIR = os.path.expanduser("~/.Trash/")
-
-
-def main():
-    # prompt user for input and output directories
-    input_dir = input(
-        "Enter the path to the directory containing .flac files: "
-    ).strip()
-    output_dir = input(
-        "Enter the path to the output directory for .wav files: "
-    ).strip()
-
-    # validate the input directory
-    if not os.path.isdir(input_dir):
-        print(f"Error: The input directory '{input_dir}' does not exist.")
-        return
-
-    # create the output directory if it does not exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+from functools import partial
+
+from audio_converter import (
+    build_parser,
+    convert_directory,
+    find_files,
+    is_converted,
+    output_path,
+    record_conversion,
+    retire_original,
+    transcode,
+)
+
+
+def main(argv=None):
+    args = build_parser("flac", "wav").parse_args(argv)
+
+    # prompt user for any directory not given on the command line
+    input_dir = (
+        args.input_dir
+        or input("Enter the path to the directory containing .flac files: ").strip()
+    )
+    output_dir = (
+        args.output_dir
+        or input("Enter the path to the output directory for .wav files: ").strip()
+    )
 
-    # process the files using a thread pool
-    with ThreadPoolExecutor(max_workers=16) as executor:
-        for original_filename in find_flacs(input_dir):
-            executor.submit(convert, original_filename, output_dir)
+    find = partial(find_flacs, include=args.include or ["*.flac"], exclude=args.exclude)
+    convert_directory(
+        input_dir,
+        output_dir,
+        find,
+        convert,
+        max_workers=args.workers,
+        timeout=args.timeout,
+        policy=args.originals,
+    )
 
 
-def find_flacs(directory):
+def find_flacs(directory, include=("*.flac",), exclude=()):
     """Find all .flac files in the specified directory and its subdirectories."""
-    command = ["find", directory, "-type", "f", "-iname", "*.flac", "-print0"]
-    names = subprocess.check_output(command, universal_newlines=True)
-    for name in names.split("\0"):
-        if name:
-            yield name
-
-
-def convert(original_filename, output_dir):
-    """Convert a .flac file to .wav and move the original to Trash."""
-    print(f"Converting: {original_filename}")
-    base_name = os.path.basename(original_filename).rsplit(".", 1)[0]
-    wav_filename = os.path.join(output_dir, base_name + ".wav")
-
-    if os.path.exists(wav_filename):
+    return find_files(directory, include, exclude)
+
+
+def convert(
+    original_filename,
+    output_dir,
+    timeout=None,
+    input_dir=None,
+    manifest=None,
+    retire=retire_original,
+):
+    """
+    Convert a .flac file to .wav and hand the original to retire,
+    which moves it to Trash by default.
+    If input_dir is given, the file's folder layout below it is kept in
+    output_dir. If a manifest from load_manifest is given, files it records
+    as converted are skipped and new conversions are added to it.
+    Returns True if the file was converted, False if ffmpeg failed or ran
+    longer than timeout seconds, and None if the file was skipped.
+    """
+    wav_filename = output_path(original_filename, output_dir, ".wav", input_dir)
+
+    # check if the file was already converted
+    if manifest is None:
+        done = os.path.exists(wav_filename)
+    else:
+        done = is_converted(manifest, original_filename, wav_filename)
+    if done:
         print(f"\t{wav_filename} already exists! Skipping...")
-        return
+        return None
 
-    return_code = subprocess.call(
+    print(f"Converting: {original_filename}")
+    succeeded = transcode(
+        original_filename,
+        wav_filename,
         [
-            "ffmpeg",
-            "-i",
-            original_filename,
             "-acodec",
             "pcm_s16le",
             "-ar",
             "44100",
-            wav_filename,
-        ]
+        ],
+        timeout,
     )
 
-    if return_code == 0:
+    # check if the conversion was successful
+    if succeeded:
         print(f"\tSuccessfully converted to {wav_filename}")
-        trash_file(original_filename)
+        if manifest is not None:
+            record_conversion(output_dir, manifest, original_filename, wav_filename)
+        retire(original_filename, wav_filename)
     else:
         print(f"\tError converting {original_filename}")
-
-
-def trash_file(filename):
-    """Move a file to the Trash directory."""
-    base_filename = os.path.basename(filename)
-    trash_filename = os.path.join(TRASH_DIR, base_filename)
-
-    # append a timestamp if a file with the same name already exists in Trash
-    if os.path.exists(trash_filename):
-        name, ext = os.path.splitext(base_filename)
-        date_bit = f" ({dt.datetime.now().isoformat()})"
-        trash_filename = os.path.join(TRASH_DIR, name + date_bit + ext)
-
-    shutil.move(filename, trash_filename)
-    print(f"\tMoved {filename} to Trash")
+    return succeeded
 
 
 if __name__ == "__main__":
@@ -1,96 +1,209 @@
 # python
 import os
-import datetime as dt
-import shutil
-import subprocess
-from concurrent.futures import ThreadPoolExecutor
-
-# define the Trash directory for deleted files
-TRASH_DIR = os.path.expanduser("~/.Trash/")
+import inspect
+import itertools
+import sys
+import tempfile
+import time
+import wave
+from functools import partial
+
+from audio_converter import (
+    build_parser,
+    convert_directory,
+    find_files,
+    is_converted,
+    output_path,
+    partial_path,
+    record_conversion,
+    retire_original,
+    transcode,
+)
+
+try:
+    import soundfile
+except ImportError:
+    # without soundfile every file is converted with ffmpeg
+    soundfile = None
+
+# maximum compression for FLAC, for the soundfile versions (0.12 and later)
+# that accept a compression level at all
+FLAC_OPTIONS = {}
+if soundfile is not None:
+    if "compression_level" in inspect.signature(soundfile.SoundFile).parameters:
+        FLAC_OPTIONS["compression_level"] = 1.0
+
+# ffmpeg options used for every conversion
+FFMPEG_ARGUMENTS = [
+    "-compression_level",
+    # maximum compression for FLAC
+    "12",
+    "-loglevel",
+    "error",
+]
+
+# number of frames read from a .wav file per write to the FLAC encoder
+FRAMES_PER_BLOCK = 65536
+
+
+def main(argv=None):
+    """Main function to handle user input and initiate conversion."""
+    parser = build_parser("wav", "flac")
+    parser.add_argument(
+        "--ffmpeg-only",
+        action="store_true",
+        help="convert every file with ffmpeg, even when soundfile is installed",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="compare files/sec of the in-process encoder and ffmpeg, then exit",
+    )
+    args = parser.parse_args(argv)
 
+    # prompt user for any directory not given on the command line
+    input_dir = (
+        args.input_dir
+        or input("Enter the path to the directory containing .wav files: ").strip()
+    )
+    output_dir = (
+        args.output_dir
+        or input("Enter the path to the output directory for .flac files: ").strip()
+    )
 
-def main():
-    """Main function to handle user input and initiate conversion."""
-    # prompt user for input and output directories
-    input_dir = input("Enter the path to the directory containing .wav files: ").strip()
-    output_dir = input(
-        "Enter the path to the output directory for .flac files: "
-    ).strip()
-
-    # validate the input directory
-    if not os.path.isdir(input_dir):
-        print(f"Error: The input directory '{input_dir}' does not exist.")
+    find = partial(find_wavs, include=args.include or ["*.wav"], exclude=args.exclude)
+    if args.benchmark:
+        benchmark(find(input_dir))
         return
 
-    # create the output directory if it does not exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    # process the files using a thread pool
-    with ThreadPoolExecutor(max_workers=16) as executor:
-        for original_filename in find_wavs(input_dir):
-            executor.submit(convert, original_filename, output_dir)
+    convert_directory(
+        input_dir,
+        output_dir,
+        find,
+        partial(convert, in_process=not args.ffmpeg_only),
+        max_workers=args.workers,
+        timeout=args.timeout,
+        policy=args.originals,
+    )
 
 
-def find_wavs(directory):
+def find_wavs(directory, include=("*.wav",), exclude=()):
     """Find all .wav files in the specified directory and its subdirectories."""
-    command = ["find", directory, "-type", "f", "-iname", "*.wav", "-print0"]
+    return find_files(directory, include, exclude)
+
+
+def encode_flac(original_filename, flac_filename):
+    """
+    Encode a 16-bit PCM .wav file to .flac in this process, without ffmpeg.
+    Frames are read in blocks with the wave module and handed straight to
+    libsndfile's FLAC encoder through soundfile. Returns False without
+    leaving any output if soundfile is not installed or the file is not
+    plain 16-bit PCM, so that ffmpeg can convert it instead.
+    """
+    # wave returns little-endian samples, which soundfile reads as native
+    if soundfile is None or sys.byteorder != "little":
+        return False
+
+    partial_filename = partial_path(flac_filename)
     try:
-        names = subprocess.check_output(command, universal_newlines=True)
-        for name in names.split("\0"):
-            if name:
-                yield name
-    except subprocess.CalledProcessError as e:
-        print(f"Error finding files: {e}")
-
-
-def convert(original_filename, output_dir):
-    """Convert a .wav file to .flac and move the original to Trash."""
-    print(f"Converting: {original_filename}")
-    base_name = os.path.basename(original_filename).rsplit(".", 1)[0]
-    flac_filename = os.path.join(output_dir, base_name + ".flac")
-
-    # check if the .flac file already exists
-    if os.path.exists(flac_filename):
+        with wave.open(original_filename, "rb") as wav:
+            if wav.getsampwidth() != 2:
+                return False
+            with soundfile.SoundFile(
+                partial_filename,
+                "w",
+                samplerate=wav.getframerate(),
+                channels=wav.getnchannels(),
+                format="FLAC",
+                subtype="PCM_16",
+                **FLAC_OPTIONS,
+            ) as flac:
+                while True:
+                    frames = wav.readframes(FRAMES_PER_BLOCK)
+                    if not frames:
+                        break
+                    flac.buffer_write(frames, dtype="int16")
+    except (wave.Error, EOFError, RuntimeError, OSError):
+        # extensible, float or damaged .wav files are left to ffmpeg
+        if os.path.exists(partial_filename):
+            os.remove(partial_filename)
+        return False
+
+    os.replace(partial_filename, flac_filename)
+    return True
+
+
+def benchmark(filenames, limit=200):
+    """
+    Convert up to limit .wav files with the in-process encoder and then with
+    ffmpeg, one at a time into a temporary directory, and print the number
+    of files per second each of them managed.
+    """
+    filenames = list(itertools.islice(filenames, limit))
+    encoders = [
+        ("in-process", encode_flac),
+        ("ffmpeg", lambda wav, flac: transcode(wav, flac, FFMPEG_ARGUMENTS)),
+    ]
+    for name, encode in encoders:
+        with tempfile.TemporaryDirectory() as output_dir:
+            start = time.perf_counter()
+            converted = 0
+            for number, filename in enumerate(filenames):
+                flac_filename = os.path.join(output_dir, f"{number}.flac")
+                converted += bool(encode(filename, flac_filename))
+            elapsed = time.perf_counter() - start
+        rate = converted / elapsed if elapsed else 0.0
+        print(f"{name:>10}: {converted} files in {elapsed:.2f}s, {rate:.1f} files/sec")
+
+
+def convert(
+    original_filename,
+    output_dir,
+    timeout=None,
+    input_dir=None,
+    manifest=None,
+    retire=retire_original,
+    in_process=True,
+):
+    """
+    Convert a .wav file to .flac and hand the original to retire,
+    which moves it to Trash by default.
+    Plain 16-bit PCM files are encoded in-process when in_process is true
+    and soundfile is installed; everything else is converted with ffmpeg.
+    If input_dir is given, the file's folder layout below it is kept in
+    output_dir. If a manifest from load_manifest is given, files it records
+    as converted are skipped and new conversions are added to it.
+    Returns True if the file was converted, False if ffmpeg failed or ran
+    longer than timeout seconds, and None if the file was skipped.
+    """
+    flac_filename = output_path(original_filename, output_dir, ".flac", input_dir)
+
+    # check if the file was already converted
+    if manifest is None:
+        done = os.path.exists(flac_filename)
+    else:
+        done = is_converted(manifest, original_filename, flac_filename)
+    if done:
         print(f"\t{flac_filename} already exists! Skipping...")
-        return
+        return None
 
-    # convert the .wav file to .flac using ffmpeg
-    return_code = subprocess.call(
-        [
-            "ffmpeg",
-            "-i",
-            original_filename,
-            "-compression_level",
-            # maximum compression for FLAC
-            "12",
-            "-loglevel",
-            "error",
-            flac_filename,
-        ]
-    )
+    print(f"Converting: {original_filename}")
+    # encode plain 16-bit .wav files in-process, everything else with ffmpeg
+    succeeded = in_process and encode_flac(original_filename, flac_filename)
+    if not succeeded:
+        succeeded = transcode(
+            original_filename, flac_filename, FFMPEG_ARGUMENTS, timeout
+        )
 
     # check if the conversion was successful
-    if return_code == 0:
+    if succeeded:
         print(f"\tSuccessfully converted to {flac_filename}")
-        trash_file(original_filename)
+        if manifest is not None:
+            record_conversion(output_dir, manifest, original_filename, flac_filename)
+        retire(original_filename, flac_filename)
     else:
         print(f"\tError converting {original_filename}")
-
-
-def trash_file(filename):
-    """Move a file to the Trash directory."""
-    base_filename = os.path.basename(filename)
-    trash_filename = os.path.join(TRASH_DIR, base_filename)
-
-    # append a timestamp if a file with the same name already exists in Trash
-    if os.path.exists(trash_filename):
-        name, ext = os.path.splitext(base_filename)
-        date_bit = f" ({dt.datetime.now().isoformat()})"
-        trash_filename = os.path.join(TRASH_DIR, name + date_bit + ext)
-
-    shutil.move(filename, trash_filename)
-    print(f"\tMoved {filename} to Trash")
+    return succeeded
 
 
 if __name__ == "__main__":
@@ -1,32 +1,400 @@
 # python
+import argparse
+import csv
+import heapq
+import json
 import os
+import sqlite3
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
+from functools import lru_cache, partial
 
+from file_organiser import CATEGORY_BY_EXTENSION
 
-def get_file_size(path):
+try:
+    import pwd
+except ImportError:
+    # not available on Windows, owners are reported by user id there
+    pwd = None
+
+# schema of the on-disk size index, one row per directory
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    inode INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    files_size INTEGER NOT NULL,
+    total_size INTEGER NOT NULL,
+    mode TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+"""
+
+
+def get_file_size(path, allocated=False):
     """
     Return the size of a file in bytes.
-    If the file is inaccessible, return 0.
+    If allocated is true, return the bytes actually allocated on disk instead
+    of the apparent size. If the file is inaccessible, return 0.
     """
     try:
-        return os.path.getsize(path)
+        return stat_size(os.stat(path), allocated)
     except OSError:
         return 0
 
 
-def get_folder_size(path):
+def stat_size(stat, allocated=False):
+    """
+    Return the apparent size from a stat result, or the allocated size if
+    allocated is true. Sparse files allocate less than their apparent size.
+    """
+    # st_blocks is counted in 512-byte units and is missing on Windows
+    if allocated and hasattr(stat, "st_blocks"):
+        return stat.st_blocks * 512
+    return stat.st_size
+
+
+def get_folder_size(path, **options):
     """
     Recursively calculate the total size of a folder.
     This includes the sizes of all files and subdirectories.
+    Keyword options are passed on to scan_tree.
+    """
+    path = os.path.abspath(path)
+    return scan_tree(path, **options).get(path, 0)
+
+
+def file_group(name, stat, group_by):
+    """
+    Return the group a file belongs to when grouping by "category" (the
+    file_organiser categories), "extension" or "owner".
+    """
+    if group_by == "owner":
+        return owner_name(stat.st_uid)
+    extension = os.path.splitext(name)[1].lower()
+    if group_by == "extension":
+        return extension or "(none)"
+    return CATEGORY_BY_EXTENSION.get(extension, "Other")
+
+
+@lru_cache(maxsize=None)
+def owner_name(uid):
+    """
+    Return the user name for a user id, or the id itself if it is unknown.
+    """
+    if pwd is not None:
+        try:
+            return pwd.getpwuid(uid).pw_name
+        except KeyError:
+            pass
+    return str(uid)
+
+
+def push_largest(heap, item, limit):
+    """
+    Push a (size, path) item onto a min-heap holding at most limit items,
+    so the heap always keeps the largest items seen so far.
+    """
+    if len(heap) < limit:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+
+def default_workers():
+    """
+    Return the default number of scanner threads.
+    Listing directories is I/O bound, so use a few threads per CPU.
+    """
+    return min(32, (os.cpu_count() or 1) * 4)
+
+
+def scan_directory(
+    path, allocated=False, dedupe_links=False, device=None, top_files=0, group_by=None
+):
+    """
+    List a single directory with os.scandir.
+    Returns the total size of the files directly inside it, a list of its
+    subdirectories, a list of (st_dev, st_ino, size, path, group) for
+    hard-linked files, a min-heap of its top_files largest (size, path) files
+    and the total size per group if group_by is given (see file_group).
+    Hard-linked files are only counted here if dedupe_links is false,
+    otherwise the caller decides whether it has seen them before.
+    If device is given, subdirectories on other filesystems are skipped.
+    Entries that cannot be read are skipped.
+    """
+    files_size = 0
+    subdirs = []
+    links = []
+    largest = []
+    groups = {}
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    # never follow symlinks, so link loops cannot be entered
+                    if entry.is_dir(follow_symlinks=False):
+                        if (
+                            device is None
+                            or entry.stat(follow_symlinks=False).st_dev == device
+                        ):
+                            subdirs.append(entry.path)
+                        continue
+                    # reuse the stat result cached on the directory entry
+                    stat = entry.stat(follow_symlinks=False)
+                    size = stat_size(stat, allocated)
+                    group = file_group(entry.name, stat, group_by) if group_by else None
+                    if dedupe_links and stat.st_nlink > 1:
+                        links.append(
+                            (stat.st_dev, stat.st_ino, size, entry.path, group)
+                        )
+                        continue
+                    files_size += size
+                    if top_files:
+                        push_largest(largest, (size, entry.path), top_files)
+                    if group_by:
+                        groups[group] = groups.get(group, 0) + size
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return files_size, subdirs, links, largest, groups
+
+
+def scan_indexed_directory(path, cached, **options):
+    """
+    Stat a directory and list it only if it changed since it was indexed.
+    cached is the (inode, mtime_ns, files_size, subdirs) entry from the index,
+    or None. Returns the directory's stat result (None if it cannot be read)
+    followed by the results of scan_directory.
+    """
+    try:
+        stat = os.stat(path, follow_symlinks=False)
+    except OSError:
+        return None, 0, [], [], [], {}
+    # adding, removing or renaming an entry updates the directory's mtime
+    if cached is not None and cached[:2] == (stat.st_ino, stat.st_mtime_ns):
+        return stat, cached[2], cached[3], [], [], {}
+    return (stat,) + scan_directory(path, **options)
+
+
+def open_index(index_path):
+    """
+    Open the on-disk size index at index_path, creating it if needed.
+    """
+    index = sqlite3.connect(index_path)
+    index.executescript(INDEX_SCHEMA)
+    return index
+
+
+def get_index_entry(index, path, mode):
+    """
+    Return the (inode, mtime_ns, files_size, subdirs) entry stored for a
+    directory in the index, or None if it has not been indexed with the
+    same accounting mode.
+    """
+    row = index.execute(
+        "SELECT inode, mtime_ns, files_size FROM directories "
+        "WHERE path = ? AND mode = ?",
+        (path, mode),
+    ).fetchone()
+    if row is None:
+        return None
+    subdirs = [
+        subdir
+        for (subdir,) in index.execute(
+            "SELECT path FROM directories WHERE parent = ?", (path,)
+        )
+    ]
+    return row + (subdirs,)
+
+
+def save_index(index, root, rows):
+    """
+    Replace everything indexed under root with the freshly scanned rows.
+    """
+    prefix = os.path.join(root, "")
+    with index:
+        index.execute(
+            "DELETE FROM directories WHERE path = ? OR substr(path, 1, ?) = ?",
+            (root, len(prefix), prefix),
+        )
+        index.executemany(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+        )
+
+
+def lookup_size(index, path):
+    """
+    Return the total size recorded in the index for any indexed directory,
+    or None if it has not been indexed.
     """
-    total_size = 0
-    # walk through the directory tree
-    for dirpath, _, filenames in os.walk(path):
-        for file in filenames:
-            file_path = os.path.join(dirpath, file)
-            # add the size of each file
-            total_size += get_file_size(file_path)
-    return total_size
+    row = index.execute(
+        "SELECT total_size FROM directories WHERE path = ?",
+        (os.path.abspath(path),),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def scan_tree(
+    root,
+    max_workers=None,
+    on_dir=None,
+    index=None,
+    allocated=False,
+    dedupe_links=False,
+    one_file_system=False,
+    on_files=None,
+    top_files=0,
+    group_by=None,
+    keep_sizes=True,
+):
+    """
+    Scan a directory tree in a single pass and return a dictionary mapping
+    every directory path in it to its total size in bytes.
+    Directories are listed in parallel on a bounded thread pool and sizes are
+    added up bottom-up: once all subdirectories of a directory are done its
+    total is final and on_dir(path, size) is called, if given.
+
+    If an index opened with open_index is given, directories whose inode and
+    mtime match the index are not listed again, and the index is updated with
+    the results. Note that a file growing in place does not change the mtime
+    of its directory, so that growth is only seen once the directory changes.
+
+    By default every file counts its apparent size. With allocated=True the
+    blocks allocated on disk are counted instead, which is much smaller for
+    sparse files. With dedupe_links=True a file with several hard links is
+    only counted the first time it is seen, and with one_file_system=True
+    directories on other filesystems are skipped, like du -x.
+
+    If on_files is given, on_files(largest, groups) is called for every
+    listed directory with a min-heap of its top_files largest (size, path)
+    files and its total size per group_by group (see file_group). Since that
+    needs every directory to be listed, the index is then only written to,
+    and the same goes for dedupe_links=True, where a cached directory could
+    not tell which of its hard links another directory has already counted.
+    With keep_sizes=False the returned dictionary is left empty, so memory
+    does not grow with the number of directories.
+    """
+    root = os.path.abspath(root)
+    max_workers = max_workers or default_workers()
+    device = None
+    if one_file_system:
+        try:
+            device = os.stat(root).st_dev
+        except OSError:
+            pass
+    scan = partial(
+        scan_directory,
+        allocated=allocated,
+        dedupe_links=dedupe_links,
+        device=device,
+        top_files=top_files,
+        group_by=group_by,
+    )
+    # the accounting mode is stored with each indexed directory
+    mode = f"{int(allocated)}{int(dedupe_links)}{int(one_file_system)}"
+    # hard-linked files seen so far: st_dev -> set of inode numbers
+    seen_links = {}
+    sizes = {}
+    # rows to write back to the index, if any
+    rows = []
+    # stat results of unfinished directories, only kept when indexing
+    stats = {}
+    # unfinished directories: path -> [size so far, pending subdirectories, parent]
+    pending = {}
+
+    def finish(path):
+        # record a finished directory and propagate its total to its parents
+        while True:
+            size, _, parent = pending.pop(path)
+            if keep_sizes:
+                sizes[path] = size
+            if on_dir is not None:
+                on_dir(path, size)
+            if path in stats:
+                stat, files_size = stats.pop(path)
+                rows.append(
+                    (
+                        path,
+                        parent or parent_of_root,
+                        stat.st_ino,
+                        stat.st_mtime_ns,
+                        files_size,
+                        size,
+                        mode,
+                    )
+                )
+            if parent is None:
+                return
+            parent_entry = pending[parent]
+            parent_entry[0] += size
+            parent_entry[1] -= 1
+            if parent_entry[1]:
+                return
+            path = parent
+
+    # keep the root linked to its parent so an enclosing scan can find it
+    parent_of_root = os.path.dirname(root) if os.path.dirname(root) != root else None
+
+    # directories waiting to be listed, walked depth-first to keep this small
+    stack = [(root, None)]
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while stack or in_flight:
+            # keep a bounded number of listings queued on the pool
+            while stack and len(in_flight) < max_workers * 2:
+                path, parent = stack.pop()
+                if index is None:
+                    future = executor.submit(scan, path)
+                else:
+                    cached = None
+                    # a cached total may include a hard link that a rescanned
+                    # directory would then count again, so with dedupe_links
+                    # every directory is listed
+                    if on_files is None and not dedupe_links:
+                        cached = get_index_entry(index, path, mode)
+                    future = executor.submit(
+                        scan_indexed_directory, path, cached, **scan.keywords
+                    )
+                in_flight[future] = (path, parent)
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, parent = in_flight.pop(future)
+                if index is None:
+                    listing = future.result()
+                else:
+                    stat, *listing = future.result()
+                files_size, subdirs, links, largest, groups = listing
+
+                # count each hard-linked file only the first time it is seen
+                for dev, ino, size, file_path, group in links:
+                    inodes = seen_links.setdefault(dev, set())
+                    if ino in inodes:
+                        continue
+                    inodes.add(ino)
+                    files_size += size
+                    if top_files:
+                        push_largest(largest, (size, file_path), top_files)
+                    if group_by:
+                        groups[group] = groups.get(group, 0) + size
+
+                if on_files is not None:
+                    on_files(largest, groups)
+
+                if index is not None and stat is not None:
+                    stats[path] = (stat, files_size)
+                pending[path] = [files_size, len(subdirs), parent]
+                stack.extend((subdir, path) for subdir in subdirs)
+                if not subdirs:
+                    finish(path)
+
+    if index is not None:
+        save_index(index, root, rows)
+    return sizes
 
 
 def display_size(size):
@@ -41,17 +409,170 @@ def display_size(size):
     return f"{size:.2f} PB"
 
 
-def analyze_disk_usage(directory="."):
+def find_largest(directory=".", limit=10, group_by="category", **options):
+    """
+    Find the largest files and directories at any depth in a single scan.
+    Only limit items of each are kept in memory at any time, so this works
+    on trees of any size. Returns the largest files and directories as
+    lists of (size, path), largest first, and the total size per group as a
+    list of (size, group), largest first. Other keyword options are passed
+    on to scan_tree.
+    """
+    root = os.path.abspath(directory)
+    largest_files = []
+    largest_dirs = []
+    group_sizes = {}
+
+    def on_dir(path, size):
+        # the scanned directory itself is always the largest, so skip it
+        if path != root:
+            push_largest(largest_dirs, (size, path), limit)
+
+    def on_files(largest, groups):
+        for item in largest:
+            push_largest(largest_files, item, limit)
+        for group, size in groups.items():
+            group_sizes[group] = group_sizes.get(group, 0) + size
+
+    scan_tree(
+        root,
+        on_dir=on_dir,
+        on_files=on_files,
+        top_files=limit,
+        group_by=group_by,
+        keep_sizes=False,
+        **options,
+    )
+    groups = sorted(
+        ((size, group) for group, size in group_sizes.items()), reverse=True
+    )
+    return (
+        sorted(largest_files, reverse=True),
+        sorted(largest_dirs, reverse=True),
+        groups,
+    )
+
+
+def report_largest(directory=".", limit=10, group_by="category", **options):
+    """
+    Print the largest files and directories under a directory and how much
+    space each group of files takes up.
+    """
+    print(f"Largest items in: {os.path.abspath(directory)}")
+    largest_files, largest_dirs, groups = find_largest(
+        directory, limit, group_by, **options
+    )
+    for title, items in [
+        (f"Top {limit} files", largest_files),
+        (f"Top {limit} directories", largest_dirs),
+        (f"Size by {group_by}", groups),
+    ]:
+        print("=" * 50)
+        print(title)
+        for size, name in items:
+            print(f"{display_size(size):>10}  {name}")
+    print("=" * 50)
+
+
+def write_snapshot(directory, output, output_format="ndjson", **options):
+    """
+    Scan a directory and write the total size of every directory in it to
+    the text file output, in "json", "ndjson" or "csv" format. Each directory
+    is written as soon as its total is known, children before their parents,
+    so nothing but the output grows with the size of the tree. Other keyword
+    options are passed on to scan_tree.
+    """
+    written = 0
+
+    def on_dir(path, size):
+        nonlocal written
+        if output_format == "csv":
+            writer.writerow([path, size])
+        else:
+            record = json.dumps({"path": path, "size": size})
+            if output_format == "json":
+                # one array element per line, so the file stays diff-friendly
+                record = ("[\n" if not written else ",\n") + record
+            output.write(record if output_format == "json" else record + "\n")
+        written += 1
+
+    if output_format == "csv":
+        writer = csv.writer(output)
+        writer.writerow(["path", "size"])
+    scan_tree(directory, on_dir=on_dir, keep_sizes=False, **options)
+    if output_format == "json":
+        output.write("\n]\n" if written else "[]\n")
+
+
+def read_snapshot(snapshot_path):
+    """
+    Yield (path, size) for every directory in a snapshot written by
+    write_snapshot, whichever format it was written in.
+    """
+    with open(snapshot_path, newline="") as file:
+        first_line = file.readline().lstrip()
+        file.seek(0)
+        if first_line.startswith("["):
+            for record in json.load(file):
+                yield record["path"], record["size"]
+        elif first_line.startswith("{"):
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record["path"], record["size"]
+        else:
+            for row in csv.DictReader(file):
+                yield row["path"], int(row["size"])
+
+
+def diff_snapshots(old_snapshot, new_snapshot, limit=20):
+    """
+    Compare two snapshots in a single pass over each and return the limit
+    directories that grew the most as (growth, path, old size, new size),
+    largest growth first. Directories missing from the old snapshot count
+    as having grown from zero.
+    """
+    old_sizes = dict(read_snapshot(old_snapshot))
+    largest = []
+    for path, size in read_snapshot(new_snapshot):
+        old_size = old_sizes.get(path, 0)
+        if size > old_size:
+            push_largest(largest, (size - old_size, path, old_size, size), limit)
+    return sorted(largest, reverse=True)
+
+
+def report_diff(old_snapshot, new_snapshot, limit=20):
+    """
+    Print the directories that grew the most between two snapshots.
+    """
+    print(f"Largest growth from {old_snapshot} to {new_snapshot}")
+    print("=" * 50)
+    for growth, path, old_size, size in diff_snapshots(
+        old_snapshot, new_snapshot, limit
+    ):
+        print(
+            f"+{display_size(growth):>10}  {path} "
+            f"({display_size(old_size)} -> {display_size(size)})"
+        )
+    print("=" * 50)
+
+
+def analyze_disk_usage(directory=".", index_path=None, **options):
     """
     Analyze the disk usage for a specified directory.
     If no directory is provided, it defaults to the current directory.
+    If index_path is given, the size index stored there is used to skip
+    unchanged directories and is updated afterwards. Other keyword options
+    (allocated, dedupe_links, one_file_system) are passed on to scan_tree.
     """
     print(f"Analyzing disk usage for: {os.path.abspath(directory)}")
     print("=" * 50)
 
+    root = os.path.abspath(directory)
     try:
         # list all files and subdirectories in the specified directory
-        items = os.listdir(directory)
+        with os.scandir(root) as entries:
+            items = list(entries)
     except PermissionError:
         # handle cases where permission is denied
         print(f"Permission denied: {directory}")
@@ -61,24 +582,32 @@ def analyze_disk_usage(directory="."):
         print(f"Directory not found: {directory}")
         return
 
-    total_size = 0
+    # scan the whole tree once, then report its top level
+    if index_path:
+        index = open_index(index_path)
+        try:
+            dir_sizes = scan_tree(root, index=index, **options)
+        finally:
+            index.close()
+    else:
+        dir_sizes = scan_tree(root, **options)
+    total_size = dir_sizes.get(root, 0)
     folder_sizes = []
 
     # loop through all items in the directory
     for item in items:
-        item_path = os.path.join(directory, item)
-        # check if the item is a directory or a file and get its size
-        if os.path.isdir(item_path):
-            # calculate folder size
-            size = get_folder_size(item_path)
-        else:
-            # get file size
-            size = get_file_size(item_path)
+        try:
+            # check if the item is a directory or a file and get its size
+            if item.is_dir(follow_symlinks=False):
+                size = dir_sizes.get(item.path, 0)
+            else:
+                stat = item.stat(follow_symlinks=False)
+                size = stat_size(stat, options.get("allocated", False))
+        except OSError:
+            size = 0
 
         # append the item and its size to the list
-        folder_sizes.append((item, size))
-        # add to the total size
-        total_size += size
+        folder_sizes.append((item.name, size))
 
     # sort items by size in descending order
     folder_sizes.sort(key=lambda x: x[1], reverse=True)
@@ -92,9 +621,9 @@ def analyze_disk_usage(directory="."):
     print(f"Analysis completed on {datetime.now()}")
 
 
-def main():
+def prompt_and_analyze():
     """
-    Main function to prompt the user for input and analyze disk usage.
+    Prompt the user for input and analyze disk usage.
     """
     print("Enter the directory to analyze (press Enter for current directory):")
     # get user input for directory
@@ -102,8 +631,105 @@ def main():
     # ff no input is given, default to the current directory
     if not directory:
         directory = "."
-        # run the analysis
-    analyze_disk_usage(directory)
+    print("Enter an index file to speed up repeat scans (press Enter to skip):")
+    index_path = input("> ").strip()
+    # run the analysis
+    analyze_disk_usage(directory, index_path or None)
+
+    print("Show the N largest files and directories (press Enter to skip):")
+    limit = input("> ").strip()
+    if limit.isdigit() and int(limit) > 0:
+        report_largest(directory, int(limit))
+
+
+def build_parser():
+    """
+    Build the command line parser for non-interactive use.
+    """
+    parser = argparse.ArgumentParser(
+        description="Analyze disk usage. Run without arguments to be prompted."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # options shared by every command that scans a directory
+    scan_options = argparse.ArgumentParser(add_help=False)
+    scan_options.add_argument("directory", nargs="?", default=".")
+    scan_options.add_argument("--workers", type=int, help="number of scan threads")
+    scan_options.add_argument(
+        "--allocated", action="store_true", help="count allocated disk blocks"
+    )
+    scan_options.add_argument(
+        "--dedupe-links", action="store_true", help="count hard links once"
+    )
+    scan_options.add_argument(
+        "-x",
+        "--one-file-system",
+        action="store_true",
+        help="skip directories on other filesystems",
+    )
+
+    report = commands.add_parser(
+        "report", parents=[scan_options], help="print the top-level usage report"
+    )
+    report.add_argument("--index", help="size index file for incremental scans")
+
+    snapshot = commands.add_parser(
+        "snapshot",
+        parents=[scan_options],
+        help="write the size of every directory as it is scanned",
+    )
+    snapshot.add_argument(
+        "--format", choices=["json", "ndjson", "csv"], default="ndjson"
+    )
+    snapshot.add_argument("-o", "--output", help="output file (default: stdout)")
+
+    top = commands.add_parser(
+        "top", parents=[scan_options], help="print the largest files and directories"
+    )
+    top.add_argument("-n", "--limit", type=int, default=10)
+    top.add_argument(
+        "--group-by", choices=["category", "extension", "owner"], default="category"
+    )
+
+    diff = commands.add_parser(
+        "diff", help="show the directories that grew most between two snapshots"
+    )
+    diff.add_argument("old_snapshot")
+    diff.add_argument("new_snapshot")
+    diff.add_argument("-n", "--limit", type=int, default=20)
+    return parser
+
+
+def main(argv=None):
+    """
+    Main function to analyze disk usage from the command line, or to prompt
+    the user for input when no arguments are given.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        prompt_and_analyze()
+        return
+
+    args = build_parser().parse_args(argv)
+    if args.command == "diff":
+        report_diff(args.old_snapshot, args.new_snapshot, args.limit)
+        return
+
+    options = {
+        "max_workers": args.workers,
+        "allocated": args.allocated,
+        "dedupe_links": args.dedupe_links,
+        "one_file_system": args.one_file_system,
+    }
+    if args.command == "report":
+        analyze_disk_usage(args.directory, args.index, **options)
+    elif args.command == "top":
+        report_largest(args.directory, args.limit, args.group_by, **options)
+    elif args.output:
+        with open(args.output, "w", newline="") as output:
+            write_snapshot(args.directory, output, args.format, **options)
+    else:
+        write_snapshot(args.directory, sys.stdout, args.format, **options)
 
 
 if __name__ == "__main__":
@@ -1,13 +1,190 @@
 # python
+import argparse
+import datetime
+import fnmatch
+import hashlib
+import json
 import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import zipfile
-import datetime
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from file_organiser import EXTENSION_MAP
+
+# files are stored in the chunk store in pieces of at most this many bytes
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# timestamp format used in every backup and snapshot name
+TIMESTAMP_FORMAT = "%d-%m-%Y_%H%M%S"
+
+# grandfather-father-son retention keeps one backup per period of each kind,
+# identified by these strftime formats
+RETENTION_PERIODS = {
+    "hourly": "%Y-%m-%d %H",
+    "daily": "%Y-%m-%d",
+    "weekly": "%G-W%V",
+    "monthly": "%Y-%m",
+}
+
+# unreferenced chunks touched more recently than this are never collected,
+# which must be longer than any backup run takes
+GC_GRACE_SECONDS = 24 * 60 * 60
+
+# bytes read from a file at a time while compressing it
+READ_SIZE = 1024 * 1024
+
+# compressed members larger than this are spooled to disk instead of memory
+SPOOL_SIZE = 16 * 1024 * 1024
+
+# compression codecs that can be selected for zip backups
+CODECS = {
+    "stored": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bz2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+# zipfile supports zstandard from python 3.14
+if hasattr(zipfile, "ZIP_ZSTANDARD"):
+    CODECS["zstd"] = zipfile.ZIP_ZSTANDARD
 
+# formats that are already compressed are stored as they are, seeded from
+# the file_organiser categories minus the formats in them that do compress
+STORED_EXTENSIONS = {
+    extension
+    for category in ["Images", "Videos", "Audio", "Archives"]
+    for extension in EXTENSION_MAP[category]
+} - {".bmp", ".svg", ".wav", ".tar"} | {".docx", ".xlsx", ".pptx", ".epub"}
 
-def backup_directory(source_dir, backup_dir):
+# bytes at the start of a file used to probe whether it compresses
+PROBE_SIZE = 64 * 1024
+
+# files whose probe does not shrink below this ratio are stored
+PROBE_RATIO = 0.9
+
+
+def choose_compression(arcname, sample, compress_type, probe=True):
+    """
+    return the compression type to use for a file: ZIP_STORED for formats
+    that are already compressed and, if probe is true, for files whose
+    first PROBE_SIZE bytes do not shrink with a fast deflate. otherwise the
+    selected compress_type.
+    """
+    if compress_type == zipfile.ZIP_STORED:
+        return compress_type
+    if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    if probe and len(sample) >= PROBE_SIZE:
+        probed = zlib.compress(sample[:PROBE_SIZE], 1)
+        if len(probed) > PROBE_SIZE * PROBE_RATIO:
+            return zipfile.ZIP_STORED
+    return compress_type
+
+
+def compress_member(
+    file_path, arcname, compress_type=zipfile.ZIP_DEFLATED, level=None, probe=True
+):
+    """
+    read and compress one file for a zip archive. returns its ZipInfo, with
+    the CRC and sizes filled in, and a file holding the compressed data.
+    runs on a worker thread; the compressors release the GIL while they work.
+    """
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    compressed = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    crc = 0
+    file_size = 0
+    with open(file_path, "rb") as file:
+        data = file.read(READ_SIZE)
+        zinfo.compress_type = choose_compression(arcname, data, compress_type, probe)
+        # the same compressor objects ZipFile.write uses, None when storing
+        compressor = zipfile._get_compressor(zinfo.compress_type, level)
+        while data:
+            crc = zlib.crc32(data, crc)
+            file_size += len(data)
+            compressed.write(compressor.compress(data) if compressor else data)
+            data = file.read(READ_SIZE)
+    if compressor:
+        compressed.write(compressor.flush())
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = compressed.tell()
+    compressed.seek(0)
+    return zinfo, compressed
+
+
+def write_member(zipf, zinfo, compressed):
+    """
+    append an already compressed member to an archive open for writing.
+    this does what ZipFile.write does after compressing, so the archive's
+    central directory, including zip64 records, is written as usual.
+    """
+    zinfo.flag_bits = 0
+    if zinfo.compress_type == zipfile.ZIP_LZMA:
+        # the lzma stream ends with an end-of-stream marker
+        zinfo.flag_bits |= 0x02
+    zinfo.header_offset = zipf.fp.tell()
+    zipf.fp.write(zinfo.FileHeader())
+    shutil.copyfileobj(compressed, zipf.fp, READ_SIZE)
+    zipf.start_dir = zipf.fp.tell()
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf._didModify = True
+
+
+def write_archive(
+    zip_filename, source_dir, workers=None, codec="deflate", level=None, probe=True
+):
+    """
+    write every file under source_dir to a zip archive. files are read and
+    compressed by a pool of worker threads while this thread writes the
+    finished members to the archive in order, one at a time. only a bounded
+    number of members is in flight, so memory use does not depend on the
+    size of the tree. codec is one of CODECS, and level its compression
+    level; see choose_compression for which files are stored instead.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"unknown codec '{codec}', choose from {', '.join(CODECS)}.")
+    workers = workers or os.cpu_count() or 1
+    in_flight = deque()
+    with zipfile.ZipFile(zip_filename, "w", zipfile.ZIP_DEFLATED) as zipf:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for root, dirs, files in os.walk(source_dir):
+                for file in files:
+                    # get the full path of the file
+                    file_path = os.path.join(root, file)
+                    # calculate the relative path for the zip file
+                    arcname = os.path.relpath(file_path, start=source_dir)
+                    in_flight.append(
+                        executor.submit(
+                            compress_member,
+                            file_path,
+                            arcname,
+                            CODECS[codec],
+                            level,
+                            probe,
+                        )
+                    )
+                    # write the oldest member once enough work is queued
+                    if len(in_flight) >= workers * 2:
+                        write_member(zipf, *in_flight.popleft().result())
+            while in_flight:
+                write_member(zipf, *in_flight.popleft().result())
+
+
+def backup_directory(
+    source_dir, backup_dir, workers=None, codec="deflate", level=None, probe=True
+):
     """
     Backs up the specified directory into a zip file in the backup directory.
     the zip file is named with the source directory name and current timestamp in day-month-year format.
+    files are compressed in parallel by workers threads, one per CPU by default,
+    with the given codec and level. see write_archive for the details.
     """
     if not os.path.exists(source_dir):
         raise FileNotFoundError(f"source directory '{source_dir}' does not exist.")
@@ -22,29 +199,585 @@ def backup_directory(source_dir, backup_dir):
         os.makedirs(backup_dir)
 
     # generate a timestamped zip file name in day-month-year format
-    timestamp = datetime.datetime.now().strftime("%d-%m-%Y_%H%M%S")
+    timestamp = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
     zip_filename = os.path.join(backup_dir, f"{dir_name}_backup_{timestamp}.zip")
 
-    # create the zip file
-    with zipfile.ZipFile(zip_filename, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(source_dir):
-            for file in files:
-                # get the full path of the file
-                file_path = os.path.join(root, file)
-                # calculate the relative path for the zip file
-                arcname = os.path.relpath(file_path, start=source_dir)
-                # write the file to the zip archive
-                zipf.write(file_path, arcname)
+    # create the zip file under a temporary name, so that an unfinished
+    # backup is never mistaken for a finished one, or pruned
+    partial_filename = f"{zip_filename}.{os.getpid()}.tmp"
+    try:
+        write_archive(partial_filename, source_dir, workers, codec, level, probe)
+        os.replace(partial_filename, zip_filename)
+    finally:
+        if os.path.exists(partial_filename):
+            os.remove(partial_filename)
 
     print(f"backup completed: {zip_filename}")
+    return zip_filename
 
 
-if __name__ == "__main__":
-    print("welcome to the simple backup tool!")
-    source_dir = input("enter the full path of the directory to back up: ").strip()
-    backup_dir = input("enter the full path of the backup destination: ").strip()
+def benchmark(source_dir, worker_counts=(1, 4, 16)):
+    """
+    archive source_dir into a temporary directory with each number of
+    workers and print the throughput in MB/s of source data.
+    """
+    total_size = sum(
+        os.path.getsize(os.path.join(root, file))
+        for root, dirs, files in os.walk(source_dir)
+        for file in files
+    )
+    for workers in worker_counts:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            start = time.perf_counter()
+            write_archive(os.path.join(temp_dir, "benchmark.zip"), source_dir, workers)
+            elapsed = time.perf_counter() - start
+        print(f"{workers:>3} workers: {total_size / elapsed / 1e6:.1f} MB/s")
+
+
+def write_atomically(path, data):
+    """
+    write data to path through a temporary file, so that readers only ever
+    see the old contents or the complete new contents.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+
+def chunk_path(store_dir, digest):
+    """
+    return the path of the chunk with the given SHA-256 hex digest.
+    chunks are spread over 256 subdirectories to keep directories small.
+    """
+    return os.path.join(store_dir, "chunks", digest[:2], digest)
+
+
+def store_chunks(file_path, store_dir):
+    """
+    split a file into chunks, add the ones not already in the store and
+    return the list of their digests.
+    """
+    digests = []
+    with open(file_path, "rb") as file:
+        for data in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest = hashlib.sha256(data).hexdigest()
+            path = chunk_path(store_dir, digest)
+            # identical chunks are only ever stored once
+            if not touch_chunk(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                write_atomically(path, zlib.compress(data))
+            digests.append(digest)
+    return digests
+
+
+def touch_chunk(path):
+    """
+    mark a chunk as in use by updating its modification time, so that a
+    concurrent prune does not collect it. returns False if it is missing.
+    """
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def snapshot_time(filename):
+    """
+    return the time encoded in a backup or snapshot file name, or None if
+    it is not one.
+    """
+    match = re.search(
+        r"_(?:backup|snapshot)_(\d{2}-\d{2}-\d{4}_\d{6})\.(?:zip|json)$", filename
+    )
+    if not match:
+        return None
+    return datetime.datetime.strptime(match.group(1), TIMESTAMP_FORMAT)
+
+
+def latest_snapshot(store_dir):
+    """
+    return the path of the newest snapshot manifest in the store, or None.
+    """
+    snapshots_dir = os.path.join(store_dir, "snapshots")
+    if not os.path.isdir(snapshots_dir):
+        return None
+    snapshots = [
+        (snapshot_time(name), name)
+        for name in os.listdir(snapshots_dir)
+        if snapshot_time(name) is not None
+    ]
+    if not snapshots:
+        return None
+    return os.path.join(snapshots_dir, max(snapshots)[1])
+
+
+def load_snapshot(snapshot_path):
+    """
+    load a snapshot manifest.
+    """
+    with open(snapshot_path) as file:
+        return json.load(file)
+
+
+def incremental_backup(source_dir, backup_dir):
+    """
+    Backs up the specified directory into a content-addressed chunk store in
+    the backup directory and records the snapshot as a manifest of chunks.
+    chunks are shared by all snapshots, so unchanged data is stored once, and
+    files whose size and modification time match the previous snapshot are
+    not read at all. returns the path of the new snapshot manifest.
+    """
+    if not os.path.exists(source_dir):
+        raise FileNotFoundError(f"source directory '{source_dir}' does not exist.")
+    if not os.path.isdir(source_dir):
+        raise NotADirectoryError(f"'{source_dir}' is not a directory.")
+
+    # each source directory gets its own store next to its zip backups
+    dir_name = os.path.basename(os.path.normpath(source_dir))
+    store_dir = os.path.join(backup_dir, f"{dir_name}_store")
+    snapshots_dir = os.path.join(store_dir, "snapshots")
+    os.makedirs(snapshots_dir, exist_ok=True)
+
+    previous_path = latest_snapshot(store_dir)
+    previous_files = load_snapshot(previous_path)["files"] if previous_path else {}
+
+    files = {}
+    reused = 0
+    for root, dirs, filenames in os.walk(source_dir):
+        for file in filenames:
+            file_path = os.path.join(root, file)
+            # manifests always use forward slashes, like zip archives
+            arcname = os.path.relpath(file_path, start=source_dir).replace(os.sep, "/")
+            stat = os.stat(file_path)
+            entry = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "mode": stat.st_mode & 0o7777,
+            }
+            previous = previous_files.get(arcname)
+            if (
+                previous is not None
+                and previous["size"] == entry["size"]
+                and previous["mtime_ns"] == entry["mtime_ns"]
+                and all(
+                    touch_chunk(chunk_path(store_dir, digest))
+                    for digest in previous["chunks"]
+                )
+            ):
+                # unchanged since the last snapshot, reuse its chunks
+                entry["chunks"] = previous["chunks"]
+                reused += 1
+            else:
+                entry["chunks"] = store_chunks(file_path, store_dir)
+            files[arcname] = entry
+
+    timestamp = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+    snapshot_path = os.path.join(snapshots_dir, f"{dir_name}_snapshot_{timestamp}.json")
+    snapshot = {
+        "source": os.path.abspath(source_dir),
+        "created": datetime.datetime.now().isoformat(),
+        "files": files,
+    }
+    # the manifest is written last, so it only ever points at stored chunks
+    write_atomically(snapshot_path, json.dumps(snapshot).encode())
+
+    print(
+        f"snapshot completed: {snapshot_path} "
+        f"({len(files) - reused} files read, {reused} unchanged)"
+    )
+    return snapshot_path
+
+
+def select_members(names, paths=None):
+    """
+    return the archive names selected by paths: a name matches a path that
+    is equal to it, a folder it is in, or a glob matching it. every name is
+    selected when no paths are given.
+    """
+    if not paths:
+        return list(names)
+    prefixes = [path.strip("/") + "/" for path in paths]
+    return [
+        name
+        for name in names
+        if any(name.startswith(prefix) for prefix in prefixes)
+        or any(name == path or fnmatch.fnmatchcase(name, path) for path in paths)
+    ]
+
+
+def restore_snapshot(snapshot_path, target_dir, paths=None):
+    """
+    Restores the files in a snapshot manifest into the target directory,
+    rebuilding the same tree that backup_directory archives. if paths are
+    given only the files they select are restored, see select_members.
+    """
+    # snapshots live in <store>/snapshots, chunks in <store>/chunks
+    store_dir = os.path.dirname(os.path.dirname(os.path.abspath(snapshot_path)))
+    snapshot = load_snapshot(snapshot_path)
+    selected = select_members(snapshot["files"], paths)
+
+    for arcname in selected:
+        entry = snapshot["files"][arcname]
+        file_path = os.path.join(target_dir, *arcname.split("/"))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as file:
+            for digest in entry["chunks"]:
+                with open(chunk_path(store_dir, digest), "rb") as chunk:
+                    data = zlib.decompress(chunk.read())
+                if hashlib.sha256(data).hexdigest() != digest:
+                    raise ValueError(f"chunk {digest} of '{arcname}' is corrupt.")
+                file.write(data)
+        os.chmod(file_path, entry["mode"])
+        os.utime(file_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+    print(f"restore completed: {len(selected)} files in {target_dir}")
+
+
+def list_archive(zip_filename, paths=None):
+    """
+    print the size, compressed size, date and name of the members of a zip
+    backup, read from its central directory without touching any data.
+    """
+    with zipfile.ZipFile(zip_filename) as zipf:
+        selected = select_members(zipf.NameToInfo, paths)
+        for name in selected:
+            zinfo = zipf.NameToInfo[name]
+            date = datetime.datetime(*zinfo.date_time).strftime("%d-%m-%Y %H:%M")
+            print(f"{zinfo.file_size:>12} {zinfo.compress_size:>12}  {date}  {name}")
+    print(f"{len(selected)} files")
 
+
+def restore_archive(zip_filename, target_dir, paths=None):
+    """
+    restores the members of a zip backup selected by paths (all of them by
+    default, see select_members) into the target directory. the central
+    directory is read once and only the selected members are read and
+    decompressed, so restoring a single file takes time proportional to
+    that file, not to the archive.
+    """
+    with zipfile.ZipFile(zip_filename) as zipf:
+        selected = select_members(zipf.NameToInfo, paths)
+        for name in selected:
+            zinfo = zipf.NameToInfo[name]
+            # streams the member to disk and checks its CRC
+            file_path = zipf.extract(zinfo, target_dir)
+            if not zinfo.is_dir():
+                mtime = datetime.datetime(*zinfo.date_time).timestamp()
+                os.utime(file_path, (mtime, mtime))
+    print(f"restore completed: {len(selected)} files in {target_dir}")
+
+
+def verify_member(zipf, zinfo):
+    """
+    read a member to the end, which makes zipfile check its CRC. returns
+    None if it is intact, otherwise a description of the problem.
+    """
+    try:
+        with zipf.open(zinfo) as member:
+            while member.read(READ_SIZE):
+                pass
+    except (zipfile.BadZipFile, OSError, EOFError, RuntimeError) as e:
+        return str(e)
+    return None
+
+
+def verify_archive(zip_filename, workers=None):
+    """
+    check the CRC of every member of a zip backup, decompressing members on
+    a pool of worker threads. returns True if every member is intact.
+    """
+    workers = workers or os.cpu_count() or 1
+    # ZipFile.open is not thread-safe on a shared archive, it counts open
+    # members without a lock, so every worker reads through its own ZipFile
+    local = threading.local()
+    archives = []
+    archives_lock = threading.Lock()
+
+    def verify(zinfo):
+        if not hasattr(local, "zipf"):
+            local.zipf = zipfile.ZipFile(zip_filename)
+            with archives_lock:
+                archives.append(local.zipf)
+        return verify_member(local.zipf, zinfo)
+
+    with zipfile.ZipFile(zip_filename) as zipf:
+        members = zipf.infolist()
     try:
-        backup_directory(source_dir, backup_dir)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            errors = [
+                (zinfo.filename, error)
+                for zinfo, error in zip(members, executor.map(verify, members))
+                if error
+            ]
+    finally:
+        for archive in archives:
+            archive.close()
+    for name, error in errors:
+        print(f"corrupt: {name}: {error}")
+    print(f"verified {len(members)} files, {len(errors)} corrupt")
+    return not errors
+
+
+def expired_backups(
+    backups, keep_last=1, keep_hourly=0, keep_daily=7, keep_weekly=4, keep_monthly=12
+):
+    """
+    apply a grandfather-father-son policy to a list of (time, path) backups
+    and return the paths of the ones it does not keep. the newest keep_last
+    backups are kept, as is the newest backup of each of the newest
+    keep_hourly hours, keep_daily days, keep_weekly weeks and keep_monthly
+    months that have backups.
+    """
+    newest_first = sorted(backups, reverse=True)
+    keep = {path for _, path in newest_first[:keep_last]}
+    for period, count in [
+        ("hourly", keep_hourly),
+        ("daily", keep_daily),
+        ("weekly", keep_weekly),
+        ("monthly", keep_monthly),
+    ]:
+        periods = set()
+        for backup_time, path in newest_first:
+            if len(periods) >= count:
+                break
+            key = backup_time.strftime(RETENTION_PERIODS[period])
+            if key not in periods:
+                periods.add(key)
+                keep.add(path)
+    return [path for _, path in newest_first if path not in keep]
+
+
+def find_backups(directory, suffix):
+    """
+    group the finished backups in a directory whose names end in suffix by
+    the name of the directory they back up. returns a dictionary of lists
+    of (time, path).
+    """
+    groups = {}
+    for name in os.listdir(directory):
+        backup_time = snapshot_time(name)
+        if backup_time is None or not name.endswith(suffix):
+            continue
+        source_name = re.sub(r"_(?:backup|snapshot)_[^_]+_\d{6}\.\w+$", "", name)
+        groups.setdefault(source_name, []).append(
+            (backup_time, os.path.join(directory, name))
+        )
+    return groups
+
+
+def collect_garbage(store_dir, grace=GC_GRACE_SECONDS):
+    """
+    delete the chunks in a store that no snapshot refers to any more.
+    backups touch every chunk they use before writing their snapshot, so
+    chunks touched within the grace period are kept, and each chunk is
+    checked again after moving it aside, so a backup running at the same
+    time never loses a chunk it is about to refer to. returns the number
+    of chunks deleted.
+    """
+    snapshots_dir = os.path.join(store_dir, "snapshots")
+    referenced = set()
+    for name in os.listdir(snapshots_dir):
+        if snapshot_time(name) is not None:
+            snapshot = load_snapshot(os.path.join(snapshots_dir, name))
+            for entry in snapshot["files"].values():
+                referenced.update(entry["chunks"])
+
+    deleted = 0
+    chunks_dir = os.path.join(store_dir, "chunks")
+    for root, dirs, files in os.walk(chunks_dir):
+        for name in files:
+            # skip referenced chunks and files that are not chunks at all
+            if name in referenced or not re.fullmatch(r"[0-9a-f]{64}", name):
+                continue
+            path = os.path.join(root, name)
+            doomed_path = f"{path}.{os.getpid()}.deleting"
+            try:
+                if time.time() - os.stat(path).st_mtime < grace:
+                    continue
+                os.rename(path, doomed_path)
+                # a backup may have touched the chunk just before the rename
+                if time.time() - os.stat(doomed_path).st_mtime < grace:
+                    os.replace(doomed_path, path)
+                    continue
+                os.remove(doomed_path)
+                deleted += 1
+            except FileNotFoundError:
+                # removed by another prune
+                continue
+    return deleted
+
+
+def prune_backups(backup_dir, dry_run=False, **policy):
+    """
+    delete the zip backups and snapshots in the backup directory that the
+    retention policy expires, see expired_backups for the policy options.
+    every backed up directory is pruned separately. chunks only used by
+    expired snapshots are deleted afterwards. unfinished backups have
+    temporary names and are never touched, so this is safe to run while
+    another backup is writing. returns the paths that were expired.
+    """
+    expired = []
+    stores = []
+    for name in os.listdir(backup_dir):
+        snapshots_dir = os.path.join(backup_dir, name, "snapshots")
+        if name.endswith("_store") and os.path.isdir(snapshots_dir):
+            stores.append(os.path.join(backup_dir, name))
+
+    groups = list(find_backups(backup_dir, ".zip").values())
+    for store_dir in stores:
+        snapshots_dir = os.path.join(store_dir, "snapshots")
+        groups.extend(find_backups(snapshots_dir, ".json").values())
+    for backups in groups:
+        expired.extend(expired_backups(backups, **policy))
+
+    for path in expired:
+        print(f"{'would delete' if dry_run else 'deleting'}: {path}")
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # removed by another prune
+                pass
+
+    if not dry_run:
+        for store_dir in stores:
+            deleted = collect_garbage(store_dir)
+            if deleted:
+                print(f"deleted {deleted} unused chunks from {store_dir}")
+    print(f"prune completed: {len(expired)} backups expired")
+    return expired
+
+
+def build_parser():
+    """
+    build the command line parser for non-interactive use.
+    """
+    parser = argparse.ArgumentParser(
+        description="simple backup tool. run without arguments to be prompted."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backup = commands.add_parser("backup", help="back up a directory")
+    backup.add_argument("source_dir")
+    backup.add_argument("backup_dir")
+    backup.add_argument(
+        "--incremental",
+        action="store_true",
+        help="store a deduplicated snapshot instead of a full zip archive",
+    )
+    backup.add_argument(
+        "--workers", type=int, help="compression threads (default: one per CPU)"
+    )
+    backup.add_argument("--codec", choices=list(CODECS), default="deflate")
+    backup.add_argument("--level", type=int, help="compression level of the codec")
+    backup.add_argument(
+        "--no-probe",
+        dest="probe",
+        action="store_false",
+        help="compress every file, even when a sample of it does not shrink",
+    )
+
+    bench = commands.add_parser(
+        "benchmark", help="measure zip throughput with different worker counts"
+    )
+    bench.add_argument("source_dir")
+    bench.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+
+    restore = commands.add_parser(
+        "restore", help="restore files from a zip backup or a snapshot"
+    )
+    restore.add_argument("backup", help="zip backup or snapshot manifest")
+    restore.add_argument("target_dir")
+    restore.add_argument(
+        "paths", nargs="*", help="files, folders or globs to restore (default: all)"
+    )
+
+    listing = commands.add_parser("list", help="list the files in a zip backup")
+    listing.add_argument("backup")
+    listing.add_argument("paths", nargs="*", help="files, folders or globs to list")
+
+    prune = commands.add_parser(
+        "prune", help="delete old backups by a grandfather-father-son policy"
+    )
+    prune.add_argument("backup_dir")
+    prune.add_argument("--keep-last", type=int, default=1)
+    prune.add_argument("--keep-hourly", type=int, default=0)
+    prune.add_argument("--keep-daily", type=int, default=7)
+    prune.add_argument("--keep-weekly", type=int, default=4)
+    prune.add_argument("--keep-monthly", type=int, default=12)
+    prune.add_argument(
+        "--dry-run", action="store_true", help="only show what would be deleted"
+    )
+
+    verify = commands.add_parser("verify", help="check the CRCs of a zip backup")
+    verify.add_argument("backup")
+    verify.add_argument(
+        "--workers", type=int, help="verification threads (default: one per CPU)"
+    )
+    return parser
+
+
+def main(argv=None):
+    """
+    run the command given on the command line, or prompt for a backup when
+    there are no arguments.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("welcome to the simple backup tool!")
+        source_dir = input("enter the full path of the directory to back up: ").strip()
+        backup_dir = input("enter the full path of the backup destination: ").strip()
+        incremental = input("incremental snapshot instead of a zip? (y/n): ")
+
+        try:
+            if incremental.strip().lower() == "y":
+                incremental_backup(source_dir, backup_dir)
+            else:
+                backup_directory(source_dir, backup_dir)
+        except Exception as e:
+            print(f"error: {e}")
+        return
+
+    args = build_parser().parse_args(argv)
+    try:
+        if args.command == "backup" and args.incremental:
+            incremental_backup(args.source_dir, args.backup_dir)
+        elif args.command == "backup":
+            backup_directory(
+                args.source_dir,
+                args.backup_dir,
+                args.workers,
+                args.codec,
+                args.level,
+                args.probe,
+            )
+        elif args.command == "benchmark":
+            benchmark(args.source_dir, args.workers)
+        elif args.command == "prune":
+            prune_backups(
+                args.backup_dir,
+                dry_run=args.dry_run,
+                keep_last=args.keep_last,
+                keep_hourly=args.keep_hourly,
+                keep_daily=args.keep_daily,
+                keep_weekly=args.keep_weekly,
+                keep_monthly=args.keep_monthly,
+            )
+        elif args.command == "list":
+            list_archive(args.backup, args.paths)
+        elif args.command == "verify":
+            if not verify_archive(args.backup, args.workers):
+                sys.exit(1)
+        elif args.backup.endswith(".json"):
+            restore_snapshot(args.backup, args.target_dir, args.paths)
+        else:
+            restore_archive(args.backup, args.target_dir, args.paths)
     except Exception as e:
         print(f"error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,67 @@
 # python
 import os
+import argparse
+import getpass
 import hashlib
+import hmac
+import json
+import re
+import shutil
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+except ImportError:
+    # without cryptography only legacy files can be decrypted
+    AESGCM = ChaCha20Poly1305 = InvalidTag = None
+
+# bytes processed at a time, a multiple of the key length so that every
+# chunk starts at the beginning of the key
+CHUNK_SIZE = 1024 * 1024
+
+# encrypted files start with this magic, legacy files have no header at all
+MAGIC = b"FENCRYPT"
+FORMAT_VERSION = 1
+
+# magic, version, cipher, kdf, three kdf parameters, salt, file id and
+# segment size. the whole header is authenticated with every segment.
+HEADER = struct.Struct(">8sBBBIII16s16sI")
+
+# plaintext bytes per independently authenticated segment
+SEGMENT_SIZE = 64 * 1024
+TAG_SIZE = 16
+
+CIPHERS = {"chacha20poly1305": 1, "aes-gcm": 2}
+KDFS = {"scrypt": 1, "pbkdf2": 2}
+
+# default parameters of each KDF, stored in every header as three numbers:
+# scrypt n, r and p (about 32 MiB of memory per derivation), and the
+# number of PBKDF2-HMAC-SHA256 iterations
+KDF_PARAMS = {"scrypt": (2**15, 8, 1), "pbkdf2": (600_000, 0, 0)}
+
+# largest scrypt n calibration may pick, 1 GiB of memory with r=8
+MAX_SCRYPT_N = 2**20
+
+# futures of derived master keys by kdf, parameters, salt and password
+# fingerprint, so files sharing a salt only pay for the derivation once
+KEY_CACHE_SIZE = 64
+key_cache = {}
+key_cache_lock = threading.Lock()
+
+# passwords are fingerprinted with a random per-process key, so the cache
+# never holds anything that could be attacked outside this process
+FINGERPRINT_KEY = os.urandom(32)
+
+# completed files of a directory run, so an interrupted run can resume
+JOURNAL_NAME = ".encryption_journal.jsonl"
+journal_lock = threading.Lock()
 
 
 def generate_key(password: str) -> bytes:
@@ -8,51 +69,521 @@ def generate_key(password: str) -> bytes:
     return hashlib.sha256(password.encode()).digest()
 
 
-def xor_encrypt_decrypt(data: bytes, key: bytes) -> bytes:
+def run_kdf(password: str, kdf: int, params: tuple, salt: bytes) -> bytes:
+    """Derive a 32-byte key from the password with a salted KDF."""
+    if kdf == KDFS["scrypt"]:
+        n, r, p = params
+        # scrypt needs 128 * r * n bytes, openssl refuses a limit above INT_MAX
+        maxmem = min(256 * r * n, 2**31 - 1)
+        return hashlib.scrypt(
+            password.encode(), salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=32
+        )
+    if kdf == KDFS["pbkdf2"]:
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, params[0], 32)
+    raise ValueError(f"Unknown key derivation function: {kdf}")
+
+
+def derive_master_key(password: str, kdf: int, params: tuple, salt: bytes) -> bytes:
+    """Derive a 32-byte master key, or return it from the key cache."""
+    fingerprint = hmac.new(FINGERPRINT_KEY, password.encode(), hashlib.sha256)
+    index = (kdf, tuple(params), salt, fingerprint.digest())
+    # the cache holds a future per key, so workers starting on files with the
+    # same salt wait for one derivation, while different salts run in parallel
+    with key_cache_lock:
+        future = key_cache.get(index)
+        owner = future is None
+        if owner:
+            if len(key_cache) >= KEY_CACHE_SIZE:
+                del key_cache[next(iter(key_cache))]
+            future = key_cache[index] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        future.set_result(run_kdf(password, kdf, params, salt))
+    except BaseException as e:
+        with key_cache_lock:
+            key_cache.pop(index, None)
+        future.set_exception(e)
+    return future.result()
+
+
+def new_master_key(password: str, kdf: str = "scrypt", params: tuple = None) -> dict:
+    """Derive a master key with a fresh salt, to encrypt one or more files."""
+    salt = os.urandom(16)
+    params = params or KDF_PARAMS[kdf]
+    return {
+        "kdf": KDFS[kdf],
+        "params": params,
+        "salt": salt,
+        "key": derive_master_key(password, KDFS[kdf], params, salt),
+    }
+
+
+def calibrate_kdf(kdf: str, target: float) -> tuple:
+    """Pick the KDF parameters that take about target seconds on this machine."""
+    salt = os.urandom(16)
+    if kdf == "pbkdf2":
+        # pbkdf2 time is linear in the iterations, so time a sample and scale
+        iterations = 10_000
+        start = time.perf_counter()
+        run_kdf("calibration", KDFS[kdf], (iterations, 0, 0), salt)
+        elapsed = time.perf_counter() - start
+        iterations = max(iterations, round(iterations * target / elapsed, -3))
+        return (int(iterations), 0, 0)
+
+    # scrypt n has to be a power of two, so double it until the target is hit.
+    # every n returned has been timed, so it is known to work here.
+    _, r, p = KDF_PARAMS["scrypt"]
+    n = 2**14
+    while True:
+        start = time.perf_counter()
+        run_kdf("calibration", KDFS[kdf], (n, r, p), salt)
+        if time.perf_counter() - start >= target or n >= MAX_SCRYPT_N:
+            return (n, r, p)
+        n *= 2
+
+
+def benchmark(target: float = 0.5) -> None:
+    """Calibrate every KDF for the target time and show what it costs."""
+    print(f"Calibrating for {target:.2f}s per derivation:")
+    for kdf in KDFS:
+        params = calibrate_kdf(kdf, target)
+        start = time.perf_counter()
+        run_kdf("benchmark", KDFS[kdf], params, os.urandom(16))
+        elapsed = time.perf_counter() - start
+        print(f"{kdf:>8}: parameters {params}, {elapsed:.3f}s per derivation")
+
+    # a cached derivation costs nothing, which is what bulk runs rely on
+    salt = os.urandom(16)
+    params = KDF_PARAMS["scrypt"]
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        derive_master_key("benchmark", KDFS["scrypt"], params, salt)
+        timings.append(time.perf_counter() - start)
+    print(f"  cached: {timings[0]:.3f}s first derivation, {timings[1]:.6f}s repeated")
+
+
+def derive_file_key(master_key: bytes, file_id: bytes) -> bytes:
+    """Derive the key of a single file from the master key and its file id."""
+    return hmac.new(master_key, b"file key" + file_id, hashlib.sha256).digest()
+
+
+def make_cipher(cipher: int, key: bytes):
+    """Create the AEAD cipher with the given id."""
+    if ChaCha20Poly1305 is None:
+        raise RuntimeError("The cryptography package is required for this file.")
+    if cipher == CIPHERS["chacha20poly1305"]:
+        return ChaCha20Poly1305(key)
+    if cipher == CIPHERS["aes-gcm"]:
+        return AESGCM(key)
+    raise ValueError(f"Unknown cipher: {cipher}")
+
+
+def segment_nonce(index: int, last: bool) -> bytes:
+    """Build the STREAM nonce of a segment from its index and a last flag."""
+    return index.to_bytes(11, "big") + (b"\x01" if last else b"\x00")
+
+
+def xor_encrypt_decrypt(data: bytes, key: bytes, keystream: bytes = None) -> bytes:
     """Encrypt or decrypt data using XOR with the given key."""
-    return bytes([b ^ key[i % len(key)] for i, b in enumerate(data)])
+    if keystream is None or len(keystream) < len(data):
+        keystream = key * (len(data) // len(key) + 1)
+    # xor the whole buffer at once as two big integers
+    size = len(data)
+    value = int.from_bytes(data, "little") ^ int.from_bytes(keystream[:size], "little")
+    return value.to_bytes(size, "little")
 
 
-def encrypt_file(file_path: str, password: str) -> None:
-    """Encrypt the file at the given path."""
-    key = generate_key(password)
+def xor_stream(source, destination, key: bytes) -> None:
+    """XOR everything read from source with the key, chunk by chunk."""
+    chunk_size = CHUNK_SIZE - CHUNK_SIZE % len(key)
+    keystream = key * (chunk_size // len(key))
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        destination.write(xor_encrypt_decrypt(chunk, key, keystream))
+
+
+def rewrite_file(file_path: str, transform) -> None:
+    """Atomically replace a file with the output of transform(source, destination).
+
+    A symlink is followed, so its target is the file rewritten. Files with
+    more than one hard link are refused with ValueError, because the other
+    links would keep the old contents.
+    """
+    # replacing the link itself would leave its target untouched
+    file_path = os.path.realpath(file_path)
+    file_stat = os.stat(file_path)
+    if file_stat.st_nlink > 1:
+        raise ValueError(
+            f"'{file_path}' has {file_stat.st_nlink} hard links, "
+            "the others would keep the old contents."
+        )
+
+    # the new contents go to a sibling file, so the original stays intact
+    # until they are complete and on disk. mkstemp creates it exclusively and
+    # only readable by us, and it gets the original's mode before any data,
+    # so plaintext is never more exposed than the file it came from.
+    directory, name = os.path.split(file_path)
+    fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    try:
+        os.chmod(fd, stat.S_IMODE(file_stat.st_mode))
+        with open(fd, "wb") as destination, open(file_path, "rb") as source:
+            transform(source, destination)
+            destination.flush()
+            os.fsync(destination.fileno())
+        shutil.copystat(file_path, temp_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    # make the rename itself durable
+    if hasattr(os, "O_DIRECTORY"):
+        directory_fd = os.open(directory, os.O_DIRECTORY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+
+def is_encrypted(file_path: str) -> bool:
+    """Check whether the file at the given path is an encrypted container."""
+    with open(file_path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def read_header(file) -> dict:
+    """Read and parse the container header at the start of an open file."""
+    raw = file.read(HEADER.size)
+    if len(raw) < HEADER.size or not raw.startswith(MAGIC):
+        raise ValueError("Not an encrypted file.")
+    _, version, cipher, kdf, *params, salt, file_id, segment_size = HEADER.unpack(raw)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported format version: {version}")
+    return {
+        "raw": raw,
+        "cipher": cipher,
+        "kdf": kdf,
+        "params": tuple(params),
+        "salt": salt,
+        "file_id": file_id,
+        "segment_size": segment_size,
+    }
+
+
+def encrypt_stream(source, destination, master: dict, cipher: str) -> None:
+    """Write the container for the plaintext read from source to destination."""
+    # files sharing a master key still get keys of their own
+    file_id = os.urandom(16)
+    header = HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        CIPHERS[cipher],
+        master["kdf"],
+        *master["params"],
+        master["salt"],
+        file_id,
+        SEGMENT_SIZE,
+    )
+    aead = make_cipher(CIPHERS[cipher], derive_file_key(master["key"], file_id))
+    destination.write(header)
+
+    # read one segment ahead to know which one is the last
+    index = 0
+    segment = source.read(SEGMENT_SIZE)
+    while True:
+        following = source.read(SEGMENT_SIZE)
+        last = not following
+        nonce = segment_nonce(index, last)
+        destination.write(aead.encrypt(nonce, segment, header))
+        if last:
+            break
+        segment = following
+        index += 1
+
+
+def decrypt_segments(file, password: str, first: int = 0, last: int = None):
+    """Yield the verified plaintext of segments first to last of a container."""
+    header = read_header(file)
+    master_key = derive_master_key(
+        password, header["kdf"], header["params"], header["salt"]
+    )
+    aead = make_cipher(header["cipher"], derive_file_key(master_key, header["file_id"]))
+    stored_size = header["segment_size"] + TAG_SIZE
+    body_size = os.fstat(file.fileno()).st_size - HEADER.size
+    count = max(1, -(-body_size // stored_size))
+    if last is None:
+        last = count - 1
+
+    file.seek(HEADER.size + first * stored_size)
+    for index in range(first, min(last, count - 1) + 1):
+        segment = file.read(stored_size)
+        nonce = segment_nonce(index, index == count - 1)
+        try:
+            yield aead.decrypt(nonce, segment, header["raw"])
+        except InvalidTag:
+            # covers a wrong password as well as a modified or truncated file
+            raise ValueError(
+                f"Segment {index} failed authentication, wrong password or "
+                f"the file has been modified."
+            ) from None
+
+
+def plaintext_size(file_path: str) -> int:
+    """Return the size of the plaintext stored in a container."""
     with open(file_path, "rb") as file:
-        data = file.read()
-    encrypted_data = xor_encrypt_decrypt(data, key)
+        header = read_header(file)
+    stored_size = header["segment_size"] + TAG_SIZE
+    body_size = os.path.getsize(file_path) - HEADER.size
+    return body_size - max(1, -(-body_size // stored_size)) * TAG_SIZE
 
-    # save encrypted data back to the file
-    with open(file_path, "wb") as file:
-        file.write(encrypted_data)
+
+def decrypt_range(file_path: str, password: str, start: int, length: int) -> bytes:
+    """Decrypt and verify only the given byte range of an encrypted file."""
+    end = min(start + length, plaintext_size(file_path))
+    if start >= end:
+        return b""
+    with open(file_path, "rb") as file:
+        header = read_header(file)
+        segment_size = header["segment_size"]
+        first = start // segment_size
+        file.seek(0)
+        data = b"".join(
+            decrypt_segments(file, password, first, (end - 1) // segment_size)
+        )
+    offset = start - first * segment_size
+    return data[offset : offset + end - start]
+
+
+def encrypt_file(
+    file_path: str,
+    password: str,
+    cipher: str = "chacha20poly1305",
+    master: dict = None,
+    kdf: str = "scrypt",
+    params: tuple = None,
+) -> None:
+    """Encrypt the file at the given path."""
+    if master is None:
+        master = new_master_key(password, kdf, params)
+    rewrite_file(
+        file_path,
+        lambda source, destination: encrypt_stream(source, destination, master, cipher),
+    )
     print(f"File '{file_path}' has been encrypted.")
 
 
 def decrypt_file(file_path: str, password: str) -> None:
     """Decrypt the file at the given path."""
-    key = generate_key(password)
-    with open(file_path, "rb") as file:
-        encrypted_data = file.read()
-    decrypted_data = xor_encrypt_decrypt(encrypted_data, key)
+    if not is_encrypted(file_path):
+        # files from before the container format are plain XOR
+        key = generate_key(password)
+        rewrite_file(
+            file_path,
+            lambda source, destination: xor_stream(source, destination, key),
+        )
+        print(f"File '{file_path}' has been decrypted.")
+        return
 
-    # save decrypted data back to the file
-    with open(file_path, "wb") as file:
-        file.write(decrypted_data)
+    # the file is only replaced once every segment has been verified
+    rewrite_file(
+        file_path,
+        lambda source, destination: destination.writelines(
+            decrypt_segments(source, password)
+        ),
+    )
     print(f"File '{file_path}' has been decrypted.")
 
 
-def main():
-    print("File Encryptor/Decryptor")
-    file_path = input("Enter the file path: ")
-    password = input("Enter a password: ")
-    action = input("Do you want to (e)ncrypt or (d)ecrypt the file? ").lower()
+def find_files(directory: str) -> list:
+    """List the regular files under a directory, largest first."""
+    files = []
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            # skip the journal and temporary files left by a crash
+            if name == JOURNAL_NAME or re.fullmatch(r"\..+\.\w{8}\.tmp", name):
+                continue
+            path = os.path.join(root, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                files.append((os.path.getsize(path), path))
+    # large files first, so one of them does not finish the run on its own
+    files.sort(reverse=True)
+    return [path for _, path in files]
 
-    if not os.path.isfile(file_path):
+
+def load_journal(directory: str, action: str) -> dict:
+    """Load the files an earlier run with the same action has completed."""
+    done = {}
+    try:
+        with open(os.path.join(directory, JOURNAL_NAME)) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line of an interrupted run may be cut short
+                    continue
+                if record["action"] != action:
+                    # a run with the other action makes the journal stale
+                    return {}
+                done[record["path"]] = (record["size"], record["mtime_ns"])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def process_directory(
+    directory: str,
+    password: str,
+    action: str,
+    max_workers: int = None,
+    cipher: str = "chacha20poly1305",
+    kdf: str = "scrypt",
+    params: tuple = None,
+) -> dict:
+    """Encrypt or decrypt every file in a directory tree on a worker pool."""
+    done = load_journal(directory, action)
+    files = find_files(directory)
+    pending = []
+    for path in files:
+        file_stat = os.stat(path)
+        if done.get(os.path.relpath(path, directory)) != (
+            file_stat.st_size,
+            file_stat.st_mtime_ns,
+        ):
+            pending.append(path)
+
+    # the key is derived once for the whole run, files differ by their file id
+    master = new_master_key(password, kdf, params) if action == "encrypt" else None
+    journal = open(
+        os.path.join(directory, JOURNAL_NAME), "a" if done else "w", encoding="utf-8"
+    )
+
+    def process(path):
+        # the magic is checked on every file, so a file is never encrypted
+        # twice even if the journal is lost. files without it are skipped
+        # when decrypting, because plaintext and legacy files look the same.
+        if is_encrypted(path) == (action == "encrypt"):
+            result = "skipped"
+        elif action == "encrypt":
+            encrypt_file(path, password, cipher, master)
+            result = "processed"
+        else:
+            decrypt_file(path, password)
+            result = "processed"
+        file_stat = os.stat(path)
+        record = {
+            "action": action,
+            "path": os.path.relpath(path, directory),
+            "size": file_stat.st_size,
+            "mtime_ns": file_stat.st_mtime_ns,
+        }
+        with journal_lock:
+            journal.write(json.dumps(record) + "\n")
+            journal.flush()
+        return result
+
+    counts = {"processed": 0, "skipped": len(files) - len(pending), "failed": 0}
+    try:
+        with ThreadPoolExecutor(max_workers or os.cpu_count()) as pool:
+            futures = {pool.submit(process, path): path for path in pending}
+            for future in as_completed(futures):
+                try:
+                    counts[future.result()] += 1
+                except (OSError, RuntimeError, ValueError) as error:
+                    print(f"Error: '{futures[future]}': {error}")
+                    counts["failed"] += 1
+    finally:
+        journal.close()
+    print(
+        f"{action.capitalize()}ed {counts['processed']} files, "
+        f"skipped {counts['skipped']}, {counts['failed']} failed."
+    )
+    return counts
+
+
+def build_parser():
+    """Build the command line parser for non-interactive use."""
+    parser = argparse.ArgumentParser(
+        description="Encrypt or decrypt a file or a whole directory tree. "
+        "Run without arguments to be prompted."
+    )
+    commands = parser.add_subparsers(dest="action", required=True)
+    for action in ["encrypt", "decrypt"]:
+        command = commands.add_parser(action, help=f"{action} a file or directory")
+        command.add_argument("path")
+        command.add_argument(
+            "--workers", type=int, help="files processed at once (default: one per CPU)"
+        )
+        if action == "encrypt":
+            command.add_argument(
+                "--cipher", choices=list(CIPHERS), default="chacha20poly1305"
+            )
+            command.add_argument("--kdf", choices=list(KDFS), default="scrypt")
+            command.add_argument(
+                "--kdf-time",
+                type=float,
+                help="calibrate the KDF to take this many seconds per derivation",
+            )
+
+    bench = commands.add_parser(
+        "benchmark", help="calibrate the KDFs for a target derivation time"
+    )
+    bench.add_argument("--target", type=float, default=0.5, help="seconds")
+    return parser
+
+
+def run(path: str, password: str, action: str, **options) -> None:
+    """Encrypt or decrypt a single file or a directory tree."""
+    # checked before any file or journal is touched
+    if action == "encrypt" and ChaCha20Poly1305 is None:
+        print("Error: The cryptography package is required for encryption.")
+        return
+    if os.path.isdir(path):
+        process_directory(path, password, action, **options)
+    elif not os.path.isfile(path):
         print("Error: File not found.")
+    else:
+        options.pop("max_workers", None)
+        try:
+            if action == "encrypt":
+                encrypt_file(path, password, **options)
+            else:
+                decrypt_file(path, password)
+        except (RuntimeError, ValueError) as error:
+            # decrypting a container needs the cryptography package as well
+            print(f"Error: {error}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        args = build_parser().parse_args(argv)
+        if args.action == "benchmark":
+            benchmark(args.target)
+            return
+        options = {"max_workers": args.workers}
+        if args.action == "encrypt":
+            options["cipher"] = args.cipher
+            options["kdf"] = args.kdf
+            if args.kdf_time:
+                options["params"] = calibrate_kdf(args.kdf, args.kdf_time)
+        run(args.path, getpass.getpass("Enter a password: "), args.action, **options)
         return
 
+    print("File Encryptor/Decryptor")
+    file_path = input("Enter the file or directory path: ")
+    password = input("Enter a password: ")
+    action = input("Do you want to (e)ncrypt or (d)ecrypt the file? ").lower()
+
     if action == "e":
-        encrypt_file(file_path, password)
+        run(file_path, password, "encrypt")
     elif action == "d":
-        decrypt_file(file_path, password)
+        run(file_path, password, "decrypt")
     else:
         print("Invalid option. Please enter 'e' or 'd'.")
 
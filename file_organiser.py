@@ -1,6 +1,15 @@
 # python
 import os
+import argparse
+import hashlib
+import itertools
+import json
 import shutil
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from trash import trash_file
 
 # define file extensions and their corresponding folder names
 EXTENSION_MAP = {
@@ -13,48 +22,617 @@ EXTENSION_MAP = {
     "Books": [".epub"],
 }
 
+# the category of each extension, for a single lookup per file
+CATEGORY_BY_EXTENSION = {
+    extension: category
+    for category, extensions in EXTENSION_MAP.items()
+    for extension in extensions
+}
+
+# moves queued per worker, so huge trees are never held in memory at once
+QUEUE_PER_WORKER = 64
+
+# folders that belong to tools rather than the user, never walked into
+# besides hidden folders such as .git and virtualenvs (found by pyvenv.cfg)
+SKIPPED_FOLDERS = {"node_modules", "__pycache__", "site-packages"}
+
+# a plan lists the moves to make, the journal the moves already started
+PLAN_NAME = ".organiser_plan.jsonl"
+JOURNAL_NAME = ".organiser_journal.jsonl"
+
+# moves applied between two journal syncs
+BATCH_SIZE = 1000
+
+# bytes read from the start of a file to recognise its content
+SNIFF_SIZE = 512
+
+# categories recognised from file contents, by the bytes found at an offset
+SIGNATURES = [
+    (0, b"\xff\xd8\xff", "Images"),
+    (0, b"\x89PNG\r\n\x1a\n", "Images"),
+    (0, b"GIF87a", "Images"),
+    (0, b"GIF89a", "Images"),
+    (0, b"<svg", "Images"),
+    (0, b"%PDF-", "Documents"),
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "Documents"),
+    (0, b"PK\x03\x04\x14\x00\x06\x00", "Documents"),
+    (30, b"mimetypeapplication/epub+zip", "Books"),
+    (0, b"PK\x03\x04", "Archives"),
+    (0, b"\x1f\x8b", "Archives"),
+    (0, b"Rar!\x1a\x07", "Archives"),
+    (257, b"ustar", "Archives"),
+    (0, b"fLaC", "Audio"),
+    (0, b"ID3", "Audio"),
+    (0, b"OggS", "Audio"),
+    (8, b"WAVE", "Audio"),
+    (8, b"M4A ", "Audio"),
+    (8, b"heic", "Images"),
+    (8, b"heix", "Images"),
+    (8, b"mif1", "Images"),
+    (8, b"avif", "Images"),
+    (8, b"AVI ", "Videos"),
+    (4, b"ftyp", "Videos"),
+    (0, b"\x1a\x45\xdf\xa3", "Videos"),
+    (0, b"#!", "Scripts"),
+    (0, b"<!DOCTYPE html", "Scripts"),
+    (0, b"<html", "Scripts"),
+]
+
+# sniffed categories that do not override a known extension: office
+# documents, books and many other formats are zip or gzip containers too
+GENERIC_CATEGORIES = {"Archives"}
+
+# categories sniffed from earlier runs, by inode, size and modification time
+SIGNATURE_CACHE_NAME = ".organiser_signatures.json"
+
+# bytes hashed from each end of a file before hashing all of it
+DEDUPE_BLOCK_SIZE = 64 * 1024
+
+# what to do with the duplicates of a file
+DEDUPE_ACTIONS = ["report", "hardlink", "trash"]
+
+
+def file_category(filename: str):
+    """Return the category of a file by its extension, or None."""
+    _, file_extension = os.path.splitext(filename)
+    return CATEGORY_BY_EXTENSION.get(file_extension.lower())
+
+
+def is_skipped_folder(entry) -> bool:
+    """Check whether a folder holds a repository, an environment or a cache."""
+    return (
+        entry.name.startswith(".")
+        or entry.name in SKIPPED_FOLDERS
+        or os.path.exists(os.path.join(entry.path, "pyvenv.cfg"))
+    )
+
+
+def sniff_category(file_path: str):
+    """Return the category of a file by its first bytes, or None."""
+    try:
+        with open(file_path, "rb") as file:
+            head = file.read(SNIFF_SIZE)
+    except OSError:
+        return None
+    # the more specific signatures come first, a docx is a zip as well
+    for offset, signature, category in SIGNATURES:
+        if head.startswith(signature, offset):
+            return category
+    return None
+
 
-def organize_files(directory: str) -> None:
+def load_signature_cache(path: str) -> dict:
+    """Load the categories sniffed by earlier runs."""
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_signature_cache(path: str, cache: dict) -> None:
+    """Save the sniffed categories for the next run, atomically."""
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(cache, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def entry_category(entry, cache: dict = None, previous: dict = None):
+    """Return the category of a directory entry, sniffing it if cache is given."""
+    category = file_category(entry.name)
+    if cache is None:
+        return category
+    stat = entry.stat()
+    key = f"{entry.inode()}:{stat.st_size}:{stat.st_mtime_ns}"
+    if key in previous:
+        cache[key] = previous[key]
+    else:
+        cache[key] = sniff_category(entry.path)
+    # specific contents win over the name, so mislabelled files are fixed too
+    if category and cache[key] in GENERIC_CATEGORIES:
+        return category
+    return cache[key] or category
+
+
+def scan_files(directory: str, recursive: bool = False, sniff: bool = False):
+    """Yield the path and category of every file that has a category."""
+    cache_path = os.path.join(directory, SIGNATURE_CACHE_NAME)
+    previous = load_signature_cache(cache_path) if sniff else None
+    # only the files seen in this run are cached again, so it never goes stale
+    cache = {} if sniff else None
+    try:
+        yield from walk_files(directory, recursive, cache, previous)
+    finally:
+        if sniff:
+            save_signature_cache(cache_path, cache)
+
+
+def walk_files(
+    directory: str, recursive: bool, cache: dict = None, previous: dict = None
+):
+    """Yield the path and category of the files found by scan_files."""
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        # never descend into the category folders themselves
+                        if (
+                            recursive
+                            and not (
+                                current == directory and entry.name in EXTENSION_MAP
+                            )
+                            and not is_skipped_folder(entry)
+                        ):
+                            stack.append(entry.path)
+                        continue
+                    # skip the plans, journals and caches of this script
+                    if not entry.is_file() or entry.name.startswith(".organiser_"):
+                        continue
+                    category = entry_category(entry, cache, previous)
+                    if category:
+                        yield entry.path, category
+        except OSError as e:
+            print(f"Error reading {current}: {e}")
+
+
+def move_file(file_path: str, target_folder: str, claimed: set, lock) -> None:
+    """Move a file into the target folder unless the name is already taken."""
+    filename = os.path.basename(file_path)
+    target_path = os.path.join(target_folder, filename)
+    # claim the name first, so two workers never move onto the same path
+    with lock:
+        taken = target_path in claimed or os.path.exists(target_path)
+        claimed.add(target_path)
+    if taken:
+        print(f"Error moving {filename}: {target_path} already exists")
+        return
+    shutil.move(file_path, target_path)
+    print(f"Moved: {filename} -> {target_folder}")
+
+
+def report_errors(futures: dict) -> None:
+    """Print the errors of finished moves."""
+    for future, file_path in futures.items():
+        error = future.exception()
+        if error is not None:
+            print(f"Error moving {os.path.basename(file_path)}: {error}")
+
+
+def organize_files(
+    directory: str,
+    recursive: bool = False,
+    max_workers: int = None,
+    sniff: bool = False,
+) -> None:
     """Organize files in the specified directory based on their extensions."""
     if not os.path.isdir(directory):
         print(f"Error: {directory} is not a valid directory.")
         return
 
-    # get all files in the directory
-    for filename in os.listdir(directory):
-        file_path = os.path.join(directory, filename)
+    # moves wait on the disk rather than the cpu, so use more threads than cpus
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+    claimed = set()
+    lock = threading.Lock()
+    created = set()
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for file_path, folder_name in scan_files(directory, recursive, sniff):
+            # create the target folder if it doesn't exist
+            target_folder = os.path.join(directory, folder_name)
+            if target_folder not in created:
+                os.makedirs(target_folder, exist_ok=True)
+                created.add(target_folder)
+
+            # move the file to the target folder on the pool
+            future = executor.submit(move_file, file_path, target_folder, claimed, lock)
+            pending[future] = file_path
+            if len(pending) >= max_workers * QUEUE_PER_WORKER:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                report_errors({future: pending.pop(future) for future in done})
+        wait(pending)
+        report_errors(pending)
+
+
+def free_name(target: str, claimed: set) -> str:
+    """Return target, or "name (n).ext" if it is claimed or already exists."""
+    name, extension = os.path.splitext(target)
+    candidate = target
+    for n in itertools.count(1):
+        if candidate not in claimed and not os.path.lexists(candidate):
+            return candidate
+        candidate = f"{name} ({n}){extension}"
 
-        # skip if it's a directory
-        if os.path.isdir(file_path):
-            continue
 
-        # get the file extension
-        _, file_extension = os.path.splitext(filename)
+def plan_moves(
+    directory: str, plan_path: str = None, recursive: bool = False, sniff: bool = False
+) -> int:
+    """Write the moves that would organize a directory to a plan file."""
+    plan_path = plan_path or os.path.join(directory, PLAN_NAME)
+    claimed = set()
+    count = 0
+    # the plan is streamed to disk and only replaces an older one when complete
+    with open(f"{plan_path}.tmp", "w", encoding="utf-8") as plan:
+        for file_path, folder_name in scan_files(directory, recursive, sniff):
+            target = free_name(
+                os.path.join(directory, folder_name, os.path.basename(file_path)),
+                claimed,
+            )
+            claimed.add(target)
+            move = {
+                "source": os.path.relpath(file_path, directory),
+                "target": os.path.relpath(target, directory),
+            }
+            plan.write(json.dumps(move) + "\n")
+            count += 1
+    os.replace(f"{plan_path}.tmp", plan_path)
+    print(f"Planned {count} moves in {plan_path}")
+    return count
 
-        # determine the folder name based on the file extension
-        folder_name = None
-        for category, extensions in EXTENSION_MAP.items():
-            if file_extension.lower() in extensions:
-                folder_name = category
-                break
 
-        # if no matching folder is found, skip the file
-        if not folder_name:
-            continue
+def read_moves(path: str):
+    """Yield the moves in a plan or journal file."""
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # a journal line cut short by a crash, its move never started
+                continue
 
-        # create the target folder if it doesn't exist
-        target_folder = os.path.join(directory, folder_name)
-        os.makedirs(target_folder, exist_ok=True)
 
-        # move the file to the target folder
+def apply_move(
+    directory: str, source: str, target: str, missing_ok: bool = False
+) -> str:
+    """Move source to target, both relative to directory, if not done yet."""
+    source_path = os.path.join(directory, source)
+    target_path = os.path.join(directory, target)
+    if not os.path.lexists(source_path):
+        # moved by an earlier run that crashed before finishing, or gone
+        if os.path.lexists(target_path) or missing_ok:
+            return "done"
+        raise FileNotFoundError(f"{source} no longer exists")
+    if os.path.lexists(target_path):
+        raise FileExistsError(f"{target} already exists")
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    shutil.move(source_path, target_path)
+    return "moved"
+
+
+def open_journal(journal_path: str):
+    """Open a journal for appending, after any line a crash cut short."""
+    journal = open(journal_path, "a", encoding="utf-8")
+    # a record appended straight onto a torn line would be lost with it
+    if journal.tell() > 0:
+        with open(journal_path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                journal.write("\n")
+    return journal
+
+
+def write_records(journal, moves: list) -> None:
+    """Append moves to a journal and make sure they are on disk."""
+    if journal is None:
+        return
+    journal.writelines(json.dumps(move) + "\n" for move in moves)
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def run_batches(
+    directory: str,
+    moves,
+    journal_path: str = None,
+    max_workers: int = None,
+    missing_ok: bool = False,
+) -> dict:
+    """Journal, if a path is given, and then make the moves on a thread pool."""
+    counts = {"moved": 0, "done": 0, "failed": 0}
+    moves = iter(moves)
+    journal = open_journal(journal_path) if journal_path else None
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while batch := list(itertools.islice(moves, BATCH_SIZE)):
+                # write ahead: a move is on disk in the journal before it happens,
+                # so a crash never leaves a move that undo does not know about
+                write_records(journal, batch)
+
+                futures = {
+                    executor.submit(
+                        apply_move,
+                        directory,
+                        move["source"],
+                        move["target"],
+                        missing_ok,
+                    ): move
+                    for move in batch
+                }
+                failed = []
+                for future, move in futures.items():
+                    try:
+                        counts[future.result()] += 1
+                    except OSError as e:
+                        print(f"Error moving {move['source']}: {e}")
+                        counts["failed"] += 1
+                        failed.append({**move, "failed": True})
+                # failed moves are marked, so undo does not try to reverse them
+                if failed:
+                    write_records(journal, failed)
+    finally:
+        if journal is not None:
+            journal.close()
+    return counts
+
+
+def apply_plan(directory: str, plan_path: str = None, max_workers: int = None) -> dict:
+    """Make the moves in a plan, resuming a run that was interrupted."""
+    plan_path = plan_path or os.path.join(directory, PLAN_NAME)
+    journal_path = os.path.join(directory, JOURNAL_NAME)
+    counts = run_batches(directory, read_moves(plan_path), journal_path, max_workers)
+    print(
+        f"Moved {counts['moved']} files, {counts['done']} already moved, "
+        f"{counts['failed']} failed. Run undo to move them back."
+    )
+    return counts
+
+
+def undo_moves(directory: str, max_workers: int = None) -> dict:
+    """Move every file in the journal back to where it came from."""
+    journal_path = os.path.join(directory, JOURNAL_NAME)
+    if not os.path.exists(journal_path):
+        print("Nothing to undo.")
+        return {}
+    # the last record of a move says whether it failed, a later run may have
+    # retried it successfully
+    failed = {}
+    for move in read_moves(journal_path):
+        failed[move["source"], move["target"]] = move.get("failed", False)
+    moves = [
+        {"source": target, "target": source}
+        for (source, target), move_failed in failed.items()
+        if not move_failed
+    ]
+    moves.reverse()
+    # an interrupted undo is resumed by running it again, apply_move skips
+    # the moves already reversed. files deleted since they were moved cannot
+    # be moved back, which is not an error, or undo would never finish.
+    counts = run_batches(directory, moves, None, max_workers, missing_ok=True)
+    if not counts["failed"]:
+        os.remove(journal_path)
+
+    # remove the folders the moves created, if nothing else is in them
+    for folder in {os.path.dirname(move["source"]) for move in moves}:
         try:
-            shutil.move(file_path, target_folder)
-            print(f"Moved: {filename} -> {target_folder}")
-        except shutil.Error as e:
-            print(f"Error moving {filename}: {e}")
+            os.rmdir(os.path.join(directory, folder))
+        except OSError:
+            pass
+    print(f"Moved {counts['moved']} files back, {counts['failed']} failed.")
+    return counts
+
+
+def files_by_size(directory: str) -> dict:
+    """
+    Group the (path, mtime_ns) of the non-empty regular files in a tree by
+    size.
+    """
+    sizes = {}
+    inodes = set()
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not is_skipped_folder(entry):
+                            stack.append(entry.path)
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    if entry.name.startswith(".organiser_"):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    # hard links to one file are not duplicates of each other
+                    if stat.st_size == 0 or (stat.st_dev, stat.st_ino) in inodes:
+                        continue
+                    inodes.add((stat.st_dev, stat.st_ino))
+                    sizes.setdefault(stat.st_size, []).append(
+                        (entry.path, stat.st_mtime_ns)
+                    )
+        except OSError as e:
+            print(f"Error reading {current}: {e}")
+    return sizes
+
+
+def hash_ends(file_path: str, size: int) -> bytes:
+    """Hash the first and last block of a file."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        digest.update(file.read(DEDUPE_BLOCK_SIZE))
+        if size > DEDUPE_BLOCK_SIZE:
+            file.seek(max(DEDUPE_BLOCK_SIZE, size - DEDUPE_BLOCK_SIZE))
+            digest.update(file.read(DEDUPE_BLOCK_SIZE))
+    return digest.digest()
 
 
-def main():
+def hash_file(file_path: str, size: int) -> bytes:
+    """Hash all of a file."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while chunk := file.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def split_by_hash(groups: list, hash_function, max_workers: int = None) -> list:
+    """Split groups of same-size files by a hash computed on a thread pool."""
+    jobs = [(size, file) for size, files in groups for file in files]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        digests = executor.map(
+            lambda job: safe_hash(hash_function, job[0], job[1][0]), jobs
+        )
+        split = {}
+        for (size, file), digest in zip(jobs, digests):
+            if digest is not None:
+                split.setdefault((size, digest), []).append(file)
+    return [(size, files) for (size, _), files in split.items() if len(files) > 1]
+
+
+def safe_hash(hash_function, size: int, file_path: str):
+    """Run a hash function on a file, or return None if it cannot be read."""
+    try:
+        return hash_function(file_path, size)
+    except OSError as e:
+        print(f"Error reading {file_path}: {e}")
+        return None
+
+
+def find_duplicates(directory: str, max_workers: int = None) -> list:
+    """
+    Return the groups of identical files in a tree, as (size, files) where
+    files is a list of (path, mtime_ns) as they were when first seen.
+    """
+    # most files have a unique size and are never read at all
+    groups = [
+        (size, paths)
+        for size, paths in files_by_size(directory).items()
+        if len(paths) > 1
+    ]
+    # then files that differ at either end are only read there
+    groups = split_by_hash(groups, hash_ends, max_workers)
+    # and only files matching so far are read in full, unless already covered
+    small = [group for group in groups if group[0] <= 2 * DEDUPE_BLOCK_SIZE]
+    large = [group for group in groups if group[0] > 2 * DEDUPE_BLOCK_SIZE]
+    groups = small + split_by_hash(large, hash_file, max_workers)
+    return sorted((size, sorted(files)) for size, files in groups)
+
+
+def check_unchanged(file_path: str, size: int, mtime_ns: int) -> None:
+    """Raise an error if a file changed since it was hashed."""
+    stat = os.stat(file_path, follow_symlinks=False)
+    if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+        raise OSError(f"{file_path} changed since it was compared, skipped")
+
+
+def link_duplicate(original: tuple, duplicate: tuple, size: int) -> None:
+    """Replace a duplicate with a hard link to the original, atomically."""
+    temp_path = f"{duplicate[0]}.{os.getpid()}.tmp"
+    os.link(original[0], temp_path)
+    try:
+        # a run over a big tree takes hours, either file may have been edited
+        # since it was hashed, and replacing it would lose that edit
+        check_unchanged(original[0], size, original[1])
+        check_unchanged(duplicate[0], size, duplicate[1])
+        os.replace(temp_path, duplicate[0])
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def dedupe_files(directory: str, action: str = "report", max_workers: int = None):
+    """Find the duplicate files in a tree and report, hard-link or trash them."""
+    groups = find_duplicates(directory, max_workers)
+    wasted = 0
+    for size, files in groups:
+        # keep the oldest copy, the others are the duplicates
+        original, *duplicates = sorted(files, key=lambda file: file[1])
+        print(f"{len(files)} copies of {size} bytes: {original[0]}")
+        for duplicate in duplicates:
+            try:
+                if action == "hardlink":
+                    link_duplicate(original, duplicate, size)
+                    print(f"  linked: {duplicate[0]}")
+                elif action == "trash":
+                    check_unchanged(duplicate[0], size, duplicate[1])
+                    trash_file(duplicate[0])
+                else:
+                    print(f"  duplicate: {duplicate[0]}")
+                wasted += size
+            except OSError as e:
+                print(f"  error: {duplicate[0]}: {e}")
+    verb = "Reclaimed" if action != "report" else "Duplicates use"
+    print(f"{verb} {wasted} bytes in {len(groups)} groups.")
+    return groups
+
+
+def build_parser():
+    """Build the command line parser for non-interactive use."""
+    parser = argparse.ArgumentParser(
+        description="Organize files into folders by type. "
+        "Run without arguments to be prompted."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    for command, description in [
+        ("organize", "move files into category folders right away"),
+        ("plan", "write the moves that would be made to a plan file"),
+        ("apply", "make the moves in a plan file, resuming an interrupted run"),
+        ("undo", "move the files of applied plans back"),
+        ("dedupe", "find duplicate files and report, hard-link or trash them"),
+    ]:
+        subparser = commands.add_parser(command, help=description)
+        subparser.add_argument("directory")
+        subparser.add_argument("--workers", type=int, help="concurrent moves")
+        if command in ["organize", "plan"]:
+            subparser.add_argument(
+                "--recursive",
+                action="store_true",
+                help="organize files in subfolders too, except hidden and tool folders",
+            )
+            subparser.add_argument(
+                "--sniff",
+                action="store_true",
+                help="classify files by their contents as well as their names",
+            )
+        if command in ["plan", "apply"]:
+            subparser.add_argument(
+                "--plan", help=f"plan file (default: DIRECTORY/{PLAN_NAME})"
+            )
+        if command == "dedupe":
+            subparser.add_argument("--action", choices=DEDUPE_ACTIONS, default="report")
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        args = build_parser().parse_args(argv)
+        if args.command == "organize":
+            organize_files(
+                args.directory, args.recursive, args.workers, sniff=args.sniff
+            )
+        elif args.command == "plan":
+            plan_moves(args.directory, args.plan, args.recursive, args.sniff)
+        elif args.command == "apply":
+            apply_plan(args.directory, args.plan, args.workers)
+        elif args.command == "undo":
+            undo_moves(args.directory, args.workers)
+        else:
+            dedupe_files(args.directory, args.action, args.workers)
+        return
+
     print("File Organizer Script")
     target_directory = input(
         "Enter the directory to organize (leave blank for current directory): "
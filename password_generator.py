@@ -1,6 +1,76 @@
 # python
-import random
+import argparse
+import os
+import secrets
 import string
+import sys
+import time
+
+# define character pools
+LOWERCASE = string.ascii_lowercase
+UPPERCASE = string.ascii_uppercase
+DIGITS = string.digits
+SYMBOLS = string.punctuation
+ALL_CHARACTERS = LOWERCASE + UPPERCASE + DIGITS + SYMBOLS
+
+# random bytes at or above this are rejected, so every character keeps an
+# equal chance instead of the first 256 % 94 getting one more byte each
+BYTE_LIMIT = 256 - 256 % len(ALL_CHARACTERS)
+
+# maps each accepted random byte straight to its character
+BYTE_TABLE = bytes(
+    ord(ALL_CHARACTERS[byte % len(ALL_CHARACTERS)]) for byte in range(256)
+)
+REJECTED_BYTES = bytes(range(BYTE_LIMIT, 256))
+
+# character pools every password must draw from at least once
+REQUIRED_POOLS = [frozenset(UPPERCASE), frozenset(DIGITS), frozenset(SYMBOLS)]
+
+# passwords generated per draw from the operating system's random source
+BATCH_SIZE = 1024
+
+
+def check_length(length):
+    """
+    Raise ValueError unless length is between 8 and 128 characters.
+    """
+    if length < 8:
+        raise ValueError("Password length must be at least 8 characters.")
+    if length > 128:
+        raise ValueError("Password length must be no more than 128 characters.")
+
+
+def is_complex(password):
+    """
+    Check that a password contains at least one uppercase letter, one digit
+    and one special character.
+    """
+    return all(not pool.isdisjoint(password) for pool in REQUIRED_POOLS)
+
+
+def generate_passwords(count, length):
+    """
+    Generate count secure random passwords of the given length, following
+    the rules of generate_password.
+    Random bytes are drawn in one large buffer per batch and mapped to
+    characters with rejection sampling, so there is no modulo bias.
+    Passwords missing a required character are rejected as a whole, which
+    keeps every valid password equally likely.
+    """
+    check_length(length)
+    while count > 0:
+        # draw enough bytes for a batch with some room for rejected ones
+        batch = min(count, BATCH_SIZE)
+        size = batch * length * 256 // BYTE_LIMIT + length * 8
+        characters = secrets.token_bytes(size).translate(BYTE_TABLE, REJECTED_BYTES)
+        text = characters.decode("ascii")
+        for start in range(0, len(text) - length + 1, length):
+            password = text[start : start + length]
+            if is_complex(password):
+                yield password
+                count -= 1
+                if count == 0:
+                    return
 
 
 def generate_password(length):
@@ -10,39 +80,85 @@ def generate_password(length):
     - Maximum length: 128 characters
     - Must contain at least one uppercase letter, one digit, and one special character.
     """
-    if length < 8:
-        raise ValueError("Password length must be at least 8 characters.")
-    if length > 128:
-        raise ValueError("Password length must be no more than 128 characters.")
+    return next(generate_passwords(1, length))
 
-    # define character pools
-    lowercase = string.ascii_lowercase
-    uppercase = string.ascii_uppercase
-    digits = string.digits
-    symbols = string.punctuation
 
-    # ensure required complexity
-    password = [
-        # at least one uppercase letter
-        random.choice(uppercase),
-        # at least one digit
-        random.choice(digits),
-        # at least one special character
-        random.choice(symbols),
-    ]
+def write_passwords(count, length, output=None):
+    """
+    Stream count passwords to the file at output, or to stdout, one per line.
+    """
+    # check before creating the file, so a bad length leaves nothing behind
+    check_length(length)
+    file = sys.stdout
+    if output:
+        # passwords are credentials, so only the owner may read the file
+        fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # the mode above only applies to new files, tighten an existing one
+        if hasattr(os, "fchmod"):
+            os.fchmod(fd, 0o600)
+        file = open(fd, "w", encoding="ascii")
+    try:
+        for password in generate_passwords(count, length):
+            file.write(password + "\n")
+    finally:
+        if output:
+            file.close()
 
-    # fill the remaining characters from a mixed pool
-    all_characters = lowercase + uppercase + digits + symbols
-    while len(password) < length:
-        password.append(random.choice(all_characters))
 
-    # shuffle to avoid predictable patterns
-    random.shuffle(password)
+def benchmark(length=16, count=100_000):
+    """
+    Compare the batch generator with drawing one character at a time.
+    """
+    start = time.perf_counter()
+    for _ in generate_passwords(count, length):
+        pass
+    batch_rate = count / (time.perf_counter() - start)
 
-    return "".join(password)
+    # the one-character-at-a-time approach, for comparison
+    start = time.perf_counter()
+    generated = 0
+    while generated < count:
+        password = "".join(secrets.choice(ALL_CHARACTERS) for _ in range(length))
+        if is_complex(password):
+            generated += 1
+    single_rate = count / (time.perf_counter() - start)
 
+    print(f"{count} passwords of {length} characters:")
+    print(f"  batch:  {batch_rate:,.0f} passwords/sec")
+    print(f"  single: {single_rate:,.0f} passwords/sec")
+
+
+def build_parser():
+    """
+    Build the command line parser for non-interactive use.
+    """
+    parser = argparse.ArgumentParser(
+        description="Generate secure random passwords. "
+        "Run without arguments to be prompted."
+    )
+    parser.add_argument("--length", type=int, default=16, help="8 to 128")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--output", help="file to write to (default: stdout)")
+    parser.add_argument(
+        "--benchmark", action="store_true", help="measure passwords per second"
+    )
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        args = build_parser().parse_args(argv)
+        try:
+            if args.benchmark:
+                benchmark(args.length)
+            else:
+                write_passwords(args.count, args.length, args.output)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        return
 
-if __name__ == "__main__":
     print("welcome to the password generator!")
     while True:
         try:
@@ -54,3 +170,7 @@ if __name__ == "__main__":
             break
         except ValueError as e:
             print(e)
+
+
+if __name__ == "__main__":
+    main()
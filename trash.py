@@ -0,0 +1,78 @@
+# python
+import itertools
+import os
+import shutil
+
+# define the Trash directory for deleted files
+TRASH_DIR = os.path.expanduser("~/.Trash/")
+
+
+def reserve_trash_name(filename, trash_dir=TRASH_DIR):
+    """
+    Create an empty placeholder in trash_dir for filename and return its
+    path, adding " (1)", " (2)" and so on before the extension if the name
+    is taken. The placeholder is created exclusively, so two threads or
+    processes can never pick the same name.
+    """
+    name, extension = os.path.splitext(os.path.basename(filename))
+    for number in itertools.count():
+        suffix = f" ({number})" if number else ""
+        trash_filename = os.path.join(trash_dir, name + suffix + extension)
+        try:
+            with open(trash_filename, "x"):
+                return trash_filename
+        except FileExistsError:
+            continue
+
+
+def trash_file(filename, trash_queue=None, trash_dir=TRASH_DIR):
+    """
+    Move a file to the Trash directory.
+    On the same filesystem this is a single rename over the reserved name.
+    Moves to another filesystem copy the whole file, so if trash_queue is
+    given they are handed to the mover thread instead of done right away.
+    """
+    os.makedirs(trash_dir, exist_ok=True)
+    trash_filename = reserve_trash_name(filename, trash_dir)
+    try:
+        if os.stat(filename).st_dev == os.stat(trash_dir).st_dev:
+            os.replace(filename, trash_filename)
+        elif trash_queue is not None:
+            trash_queue.put((filename, trash_filename))
+            return
+        else:
+            shutil.move(filename, trash_filename)
+    except BaseException:
+        release_trash_name(filename, trash_filename)
+        raise
+    print(f"\tMoved {filename} to Trash")
+
+
+def release_trash_name(filename, trash_filename):
+    """
+    Remove the placeholder or partial copy left in the Trash by a failed
+    move, unless the original is gone and it is the only copy left.
+    """
+    try:
+        if os.path.lexists(filename) or not os.path.getsize(trash_filename):
+            os.remove(trash_filename)
+    except FileNotFoundError:
+        pass
+
+
+def move_trashed_files(trash_queue):
+    """
+    Move the (filename, trash filename) pairs put on trash_queue across
+    filesystems, one at a time, until None is put on it.
+    """
+    while True:
+        item = trash_queue.get()
+        if item is None:
+            return
+        filename, trash_filename = item
+        try:
+            shutil.move(filename, trash_filename)
+            print(f"\tMoved {filename} to Trash")
+        except OSError as e:
+            release_trash_name(filename, trash_filename)
+            print(f"\tError moving {filename} to Trash: {e}")